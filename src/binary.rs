@@ -0,0 +1,331 @@
+//! Versioned binary format for compiled graphs.
+//!
+//! The file is a fixed header followed by the plan arrays exactly as they sit
+//! in memory, each section starting on an 8-byte boundary. Opening a file
+//! memory-maps it and points the plan straight at those sections, so loading
+//! costs a validation pass rather than a parse, and every process that opens
+//! the same file shares its page-cached copy.
+//!
+//! Layout (native endianness, recorded in the header):
+//!
+//! ```text
+//! header    magic "SDAGBIN\0", version u32, endian marker u32,
+//!           nodes u64, children u64, consts u64, root u64, outputs u64,
+//!           strings u64 (byte length of the strings section)
+//! ops       u8  x nodes
+//! a         u32 x nodes
+//! b         u32 x nodes
+//! children  u32 x children
+//! consts    f64 x consts
+//! outputs   u64 x outputs
+//! strings   u32 input count, then (u32 length, utf-8 bytes) per input name
+//!           and per output name
+//! ```
+
+use crate::engine::Program;
+use crate::plan::{Buf, Op, Plan};
+use memmap2::Mmap;
+use std::ffi::OsString;
+use std::fs::File;
+use std::io::{BufWriter, Write};
+use std::path::Path;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
+
+const MAGIC: &[u8; 8] = b"SDAGBIN\0";
+const VERSION: u32 = 1;
+const ENDIAN_MARKER: u32 = 0x0102_0304;
+const HEADER_LEN: usize = 64;
+
+/// Byte offset of each section, and of the end of the file.
+struct Layout {
+    ops: usize,
+    a: usize,
+    b: usize,
+    children: usize,
+    consts: usize,
+    outputs: usize,
+    strings: usize,
+    end: usize,
+}
+
+impl Layout {
+    fn new(nodes: usize, children: usize, consts: usize, outputs: usize, strings: usize) -> Self {
+        let align = |offset: usize| (offset + 7) & !7;
+        let ops = HEADER_LEN;
+        let a = align(ops + nodes);
+        let b = align(a + 4 * nodes);
+        let children_at = align(b + 4 * nodes);
+        let consts_at = align(children_at + 4 * children);
+        let outputs_at = align(consts_at + 8 * consts);
+        let strings_at = align(outputs_at + 8 * outputs);
+        Self {
+            ops,
+            a,
+            b,
+            children: children_at,
+            consts: consts_at,
+            outputs: outputs_at,
+            strings: strings_at,
+            end: strings_at + strings,
+        }
+    }
+}
+
+/// Write a compiled program to `path`.
+pub fn write(program: &Program, path: &Path) -> Result<(), String> {
+    let plan = &program.plan;
+
+    let mut strings = Vec::new();
+    strings.extend_from_slice(&(plan.inputs.len() as u32).to_ne_bytes());
+    for name in plan.inputs.iter().chain(&program.output_names) {
+        strings.extend_from_slice(&(name.len() as u32).to_ne_bytes());
+        strings.extend_from_slice(name.as_bytes());
+    }
+
+    let layout = Layout::new(plan.len(), plan.children.len(), plan.consts.len(), program.outputs.len(), strings.len());
+    let mut header = Vec::with_capacity(HEADER_LEN);
+    header.extend_from_slice(MAGIC);
+    header.extend_from_slice(&VERSION.to_ne_bytes());
+    header.extend_from_slice(&ENDIAN_MARKER.to_ne_bytes());
+    for count in [plan.len(), plan.children.len(), plan.consts.len(), program.root, program.outputs.len(), strings.len()] {
+        header.extend_from_slice(&(count as u64).to_ne_bytes());
+    }
+
+    let ops: Vec<u8> = plan.ops.iter().map(|&op| op as u8).collect();
+    let words = |values: &[u32]| -> Vec<u8> { values.iter().flat_map(|v| v.to_ne_bytes()).collect() };
+    let consts: Vec<u8> = plan.consts.iter().flat_map(|v| v.to_ne_bytes()).collect();
+    let outputs: Vec<u8> = program.outputs.iter().flat_map(|&id| (id as u64).to_ne_bytes()).collect();
+
+    let sections: [(usize, &[u8]); 8] = [
+        (0, &header),
+        (layout.ops, &ops),
+        (layout.a, &words(&plan.a)),
+        (layout.b, &words(&plan.b)),
+        (layout.children, &words(&plan.children)),
+        (layout.consts, &consts),
+        (layout.outputs, &outputs),
+        (layout.strings, &strings),
+    ];
+    write_sections(path, &sections).map_err(|e| format!("{}: {}", path.display(), e))
+}
+
+/// Write each (offset, bytes) section, zero-padding the gaps between them.
+///
+/// Other processes may have `path` mapped, and rewriting a mapped file in
+/// place (truncating it, in particular) crashes them. So the file is written
+/// and synced under a temporary name in the same directory, then renamed
+/// over `path`: existing mappings keep the old file, new opens see the new.
+fn write_sections(path: &Path, sections: &[(usize, &[u8])]) -> std::io::Result<()> {
+    static SEQUENCE: AtomicUsize = AtomicUsize::new(0);
+    let name = path.file_name()
+        .ok_or_else(|| std::io::Error::new(std::io::ErrorKind::InvalidInput, "not a file path"))?;
+    let mut temp_name = OsString::from(".");
+    temp_name.push(name);
+    temp_name.push(format!(".{}.{}.tmp", std::process::id(), SEQUENCE.fetch_add(1, Ordering::Relaxed)));
+    let temp = path.with_file_name(temp_name);
+
+    let written = write_file(&temp, sections).and_then(|()| std::fs::rename(&temp, path));
+    if written.is_err() {
+        let _ = std::fs::remove_file(&temp);
+    }
+    written
+}
+
+fn write_file(path: &Path, sections: &[(usize, &[u8])]) -> std::io::Result<()> {
+    let mut out = BufWriter::new(File::create(path)?);
+    let mut pos = 0;
+    for &(offset, bytes) in sections {
+        out.write_all(&vec![0u8; offset - pos])?;
+        out.write_all(bytes)?;
+        pos = offset + bytes.len();
+    }
+    out.into_inner().map_err(|e| e.into_error())?.sync_all()
+}
+
+/// Memory-map a file written by `write` and rebuild the program over it.
+pub fn open(path: &Path) -> Result<Program, String> {
+    let file = File::open(path).map_err(|e| format!("{}: {}", path.display(), e))?;
+    // SAFETY: the mapping is read-only; `write` replaces files by renaming a
+    // new one over them, never modifying one in place while it is mapped.
+    let map = Arc::new(unsafe { Mmap::map(&file) }.map_err(|e| format!("{}: {}", path.display(), e))?);
+    let bytes: &[u8] = &map;
+    let bad = |what: &str| format!("{}: not a valid sdag binary graph ({})", path.display(), what);
+
+    if bytes.len() < HEADER_LEN || &bytes[..8] != MAGIC {
+        return Err(bad("bad magic"));
+    }
+    let word = |offset: usize| u32::from_ne_bytes(bytes[offset..offset + 4].try_into().unwrap());
+    let count = |field: usize| u64::from_ne_bytes(bytes[16 + 8 * field..24 + 8 * field].try_into().unwrap()) as usize;
+    if word(12) != ENDIAN_MARKER {
+        return Err(bad("written on a machine of different endianness"));
+    }
+    if word(8) != VERSION {
+        return Err(bad(&format!("version {}, expected {}", word(8), VERSION)));
+    }
+    let (nodes, children, consts, root, outputs, strings) = (count(0), count(1), count(2), count(3), count(4), count(5));
+    if [nodes, children, consts, outputs, strings].iter().any(|&n| n > bytes.len()) {
+        return Err(bad("section larger than file"));
+    }
+    let layout = Layout::new(nodes, children, consts, outputs, strings);
+    if layout.end > bytes.len() {
+        return Err(bad("truncated"));
+    }
+    if bytes[layout.ops..layout.ops + nodes].iter().any(|&op| op > Op::Div as u8) {
+        return Err(bad("unknown opcode"));
+    }
+
+    // Names: the only per-file data that is copied
+    let mut names = Vec::new();
+    let mut cursor = layout.strings;
+    let next_name = |cursor: &mut usize| -> Result<String, String> {
+        if *cursor + 4 > layout.end {
+            return Err(bad("truncated strings"));
+        }
+        let len = word(*cursor) as usize;
+        let start = *cursor + 4;
+        if start + len > layout.end {
+            return Err(bad("truncated strings"));
+        }
+        *cursor = start + len;
+        String::from_utf8(bytes[start..start + len].to_vec()).map_err(|_| bad("invalid utf-8 name"))
+    };
+    let n_inputs = if layout.strings + 4 <= layout.end { word(layout.strings) as usize } else { 0 };
+    cursor += 4;
+    for _ in 0..n_inputs + outputs {
+        names.push(next_name(&mut cursor)?);
+    }
+    let output_names = names.split_off(n_inputs);
+
+    let output_ids = (0..outputs)
+        .map(|i| u64::from_ne_bytes(bytes[layout.outputs + 8 * i..layout.outputs + 8 * i + 8].try_into().unwrap()) as usize);
+
+    // SAFETY: every section lies inside the file, starts 8-byte aligned in a
+    // page-aligned mapping, and opcodes were checked above; u32 and f64
+    // accept any bit pattern.
+    let plan = unsafe {
+        Plan {
+            ops: Buf::mapped(&map, layout.ops, nodes),
+            a: Buf::mapped(&map, layout.a, nodes),
+            b: Buf::mapped(&map, layout.b, nodes),
+            children: Buf::mapped(&map, layout.children, children),
+            consts: Buf::mapped(&map, layout.consts, consts),
+            inputs: names,
+        }
+    };
+    Program::from_plan(plan, root, output_names.into_iter().zip(output_ids).collect())
+        .map_err(|e| format!("{}: {}", path.display(), e))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::engine::{self, Emissions, RunState};
+    use crate::Node;
+    use std::path::PathBuf;
+
+    fn path(name: &str) -> PathBuf {
+        std::env::temp_dir().join(format!("sdag-binary-{}-{}.sdag", std::process::id(), name))
+    }
+
+    fn program() -> Program {
+        let nodes = vec![
+            Node::Input { name: "bid".to_string() },
+            Node::Input { name: "ask".to_string() },
+            Node::Add { children: vec![0, 1] },
+            Node::Const { value: 2.0 },
+            Node::Div { left: 2, right: 3 },
+            Node::Mul { children: vec![0, 1, 3] },
+        ];
+        let outputs = vec![("mid".to_string(), 4), ("product".to_string(), 5)];
+        Program::new(nodes, 4, outputs, Vec::new(), None, false).unwrap()
+    }
+
+    fn run(program: &Program) -> Emissions {
+        let columns = [vec![1.0, 1.0, 2.0, 2.5], vec![2.0, 2.0, 2.0, 0.0]];
+        let columns: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+        let mut out = Emissions::new(program.outputs.len());
+        let engine = engine::create("tape", program).unwrap();
+        engine.run(program, &columns, 4, &mut RunState::new(program), &mut out);
+        out
+    }
+
+    /// Write `program()`, let `corrupt` change the bytes, and open the result.
+    fn open_corrupted(name: &str, corrupt: impl FnOnce(&mut Vec<u8>)) -> Result<Program, String> {
+        let path = path(name);
+        write(&program(), &path).unwrap();
+        let mut bytes = std::fs::read(&path).unwrap();
+        corrupt(&mut bytes);
+        std::fs::write(&path, &bytes).unwrap();
+        let opened = open(&path);
+        std::fs::remove_file(&path).unwrap();
+        opened
+    }
+
+    #[test]
+    fn round_trip() {
+        let path = path("round-trip");
+        let original = program();
+        write(&original, &path).unwrap();
+        let opened = open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        assert_eq!(opened.plan.inputs, original.plan.inputs);
+        assert_eq!(opened.output_names, original.output_names);
+        assert_eq!((opened.root, &opened.outputs), (original.root, &original.outputs));
+        assert_eq!(opened.plan.ops[..], original.plan.ops[..]);
+        assert_eq!(opened.plan.children[..], original.plan.children[..]);
+        let (expected, actual) = (run(&original), run(&opened));
+        assert_eq!(expected.rows, actual.rows);
+        assert_eq!(expected.outputs, actual.outputs);
+    }
+
+    #[test]
+    fn saving_replaces_a_mapped_file() {
+        let path = path("replace");
+        write(&program(), &path).unwrap();
+        let mapped = open(&path).unwrap();
+
+        let nodes = vec![Node::Input { name: "x".to_string() }];
+        write(&Program::new(nodes, 0, Vec::new(), Vec::new(), None, false).unwrap(), &path).unwrap();
+        let reopened = open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        // The old mapping still reads the old file
+        assert_eq!(run(&mapped).outputs, run(&program()).outputs);
+        assert_eq!(reopened.plan.inputs, vec!["x"]);
+    }
+
+    #[test]
+    fn rejects_corrupted_headers() {
+        let cases: [(&str, fn(&mut Vec<u8>), &str); 6] = [
+            ("magic", |b| b[0] = b'X', "bad magic"),
+            ("version", |b| b[8..12].copy_from_slice(&(VERSION + 1).to_ne_bytes()), "version"),
+            ("endian", |b| b[12..16].copy_from_slice(&ENDIAN_MARKER.swap_bytes().to_ne_bytes()), "endianness"),
+            ("huge-count", |b| b[16..24].copy_from_slice(&u64::MAX.to_ne_bytes()), "larger than file"),
+            ("opcode", |b| b[HEADER_LEN] = 200, "unknown opcode"),
+            ("root", |b| b[40..48].copy_from_slice(&1000u64.to_ne_bytes()), "out of range"),
+        ];
+        for (name, corrupt, message) in cases {
+            match open_corrupted(name, corrupt) {
+                Ok(_) => panic!("{}: corrupted file opened", name),
+                Err(e) => assert!(e.contains(message), "{}: {}", name, e),
+            }
+        }
+    }
+
+    #[test]
+    fn rejects_truncated_files() {
+        let length = {
+            let path = path("length");
+            write(&program(), &path).unwrap();
+            let length = std::fs::metadata(&path).unwrap().len() as usize;
+            std::fs::remove_file(&path).unwrap();
+            length
+        };
+        for keep in [0, 7, HEADER_LEN - 1, HEADER_LEN + 3, length / 2, length - 1] {
+            let opened = open_corrupted(&format!("truncated-{}", keep), |b| b.truncate(keep));
+            assert!(opened.is_err(), "a file truncated to {} of {} bytes opened", keep, length);
+        }
+    }
+}
@@ -0,0 +1,185 @@
+//! Process-wide cache of compiled programs, keyed by a 128-bit digest of the
+//! frozen graph text and the build options, with least-recently-used
+//! eviction. Only the digest is stored, not the text.
+//!
+//! A hit skips parsing, pruning, simplification and plan compilation; the
+//! Sampler shares the cached program and only builds its engine.
+
+use crate::engine::Program;
+use crate::NodeId;
+use once_cell::sync::Lazy;
+use std::collections::hash_map::RandomState;
+use std::collections::HashMap;
+use std::hash::{BuildHasher, Hash, Hasher};
+use std::sync::{Arc, Mutex};
+
+pub const DEFAULT_CAPACITY: usize = 128;
+
+/// Digest of everything that determines the compiled program.
+#[derive(Clone, Copy, Hash, PartialEq, Eq)]
+pub struct Key(u128);
+
+/// Two SipHash keys drawn at random per process. Each half of a digest is
+/// keyed with one of them, so collisions cannot be crafted, and at 128 bits
+/// an accidental one is negligible.
+static DIGEST_KEYS: Lazy<[RandomState; 2]> = Lazy::new(|| [RandomState::new(), RandomState::new()]);
+
+impl Key {
+    pub fn new(yaml: &str, outputs: Option<&[NodeId]>, inputs: Option<&[String]>, simplify: bool) -> Self {
+        let half = |keys: &RandomState| {
+            let mut hasher = keys.build_hasher();
+            (yaml, outputs, inputs, simplify).hash(&mut hasher);
+            hasher.finish() as u128
+        };
+        Self(half(&DIGEST_KEYS[0]) << 64 | half(&DIGEST_KEYS[1]))
+    }
+}
+
+struct Entry {
+    program: Arc<Program>,
+    last_used: u64,
+}
+
+pub struct Cache {
+    entries: HashMap<Key, Entry>,
+    capacity: usize,
+    clock: u64,
+    pub hits: u64,
+    pub misses: u64,
+}
+
+pub static CACHE: Lazy<Mutex<Cache>> = Lazy::new(|| Mutex::new(Cache::new(DEFAULT_CAPACITY)));
+
+impl Cache {
+    fn new(capacity: usize) -> Self {
+        Self { entries: HashMap::new(), capacity, clock: 0, hits: 0, misses: 0 }
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+
+    pub fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    /// Change the size limit, evicting least recently used entries to fit.
+    /// A capacity of 0 disables caching.
+    pub fn set_capacity(&mut self, capacity: usize) {
+        self.capacity = capacity;
+        while self.entries.len() > capacity {
+            self.evict();
+        }
+    }
+
+    /// Drop every entry and reset the statistics.
+    pub fn clear(&mut self) {
+        self.entries.clear();
+        self.hits = 0;
+        self.misses = 0;
+    }
+
+    /// Look up a program, counting a hit or miss.
+    pub fn get(&mut self, key: &Key) -> Option<Arc<Program>> {
+        self.clock += 1;
+        match self.entries.get_mut(key) {
+            Some(entry) => {
+                entry.last_used = self.clock;
+                self.hits += 1;
+                Some(Arc::clone(&entry.program))
+            }
+            None => {
+                self.misses += 1;
+                None
+            }
+        }
+    }
+
+    pub fn insert(&mut self, key: Key, program: Arc<Program>) {
+        if self.capacity == 0 {
+            return;
+        }
+        if !self.entries.contains_key(&key) && self.entries.len() >= self.capacity {
+            self.evict();
+        }
+        self.clock += 1;
+        self.entries.insert(key, Entry { program, last_used: self.clock });
+    }
+
+    fn evict(&mut self) {
+        let oldest = self.entries.iter().min_by_key(|(_, entry)| entry.last_used).map(|(&key, _)| key);
+        if let Some(key) = oldest {
+            self.entries.remove(&key);
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::Node;
+
+    fn key(yaml: &str) -> Key {
+        Key::new(yaml, None, None, false)
+    }
+
+    fn program() -> Arc<Program> {
+        let nodes = vec![Node::Input { name: "a".to_string() }];
+        Arc::new(Program::new(nodes, 0, Vec::new(), Vec::new(), None, false).unwrap())
+    }
+
+    #[test]
+    fn evicts_least_recently_used() {
+        let mut cache = Cache::new(2);
+        cache.insert(key("a"), program());
+        cache.insert(key("b"), program());
+        assert!(cache.get(&key("a")).is_some());
+        cache.insert(key("c"), program());
+        assert_eq!(cache.len(), 2);
+        assert!(cache.get(&key("b")).is_none());
+        assert!(cache.get(&key("a")).is_some());
+        assert!(cache.get(&key("c")).is_some());
+
+        // Re-inserting a cached key replaces it without evicting
+        cache.insert(key("a"), program());
+        assert_eq!(cache.len(), 2);
+        assert!(cache.get(&key("c")).is_some());
+    }
+
+    #[test]
+    fn shrinking_evicts_to_fit() {
+        let mut cache = Cache::new(3);
+        for yaml in ["a", "b", "c"] {
+            cache.insert(key(yaml), program());
+        }
+        assert!(cache.get(&key("a")).is_some());
+        cache.set_capacity(1);
+        assert_eq!((cache.len(), cache.capacity()), (1, 1));
+        assert!(cache.get(&key("a")).is_some());
+    }
+
+    #[test]
+    fn zero_capacity_disables_caching() {
+        let mut cache = Cache::new(2);
+        cache.insert(key("a"), program());
+        cache.set_capacity(0);
+        assert_eq!(cache.len(), 0);
+        cache.insert(key("b"), program());
+        assert_eq!(cache.len(), 0);
+        assert!(cache.get(&key("b")).is_none());
+    }
+
+    #[test]
+    fn counts_hits_and_misses() {
+        let mut cache = Cache::new(2);
+        assert!(cache.get(&key("a")).is_none());
+        cache.insert(key("a"), program());
+        assert!(cache.get(&key("a")).is_some());
+        assert!(cache.get(&key("a")).is_some());
+        assert!(cache.get(&key("b")).is_none());
+        assert_eq!((cache.hits, cache.misses), (2, 2));
+
+        cache.clear();
+        assert_eq!((cache.len(), cache.hits, cache.misses), (0, 0, 0));
+    }
+}
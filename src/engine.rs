@@ -0,0 +1,1256 @@
+//! Evaluation engines: interchangeable strategies for sweeping a frozen graph
+//! over rows of input and sampling its outputs whenever the trigger changes.
+
+use crate::optimize;
+use crate::plan::{Op, Plan};
+use crate::{Node, NodeId};
+use rayon::prelude::*;
+use std::cell::RefCell;
+use std::collections::HashMap;
+
+/// A frozen graph resolved for evaluation: its compiled plan and the
+/// trigger/output roles.
+pub struct Program {
+    pub plan: Plan,
+    pub root: NodeId,
+    pub outputs: Vec<NodeId>,
+    /// Result key of each output
+    pub output_names: Vec<String>,
+    /// Constant nodes marked as named parameters, which a sweep overrides
+    pub params: Vec<NodeId>,
+    pub param_names: Vec<String>,
+    /// Net node count removed by `optimize::simplify` when the program was
+    /// built
+    pub simplified: usize,
+}
+
+impl Program {
+    /// Resolve a frozen arena. Only the cone of nodes that the trigger and
+    /// outputs depend on is kept, so anything else in the arena costs nothing
+    /// at run time, and it is put in dependency order for the engines.
+    /// With `simplify`, constants are folded and the arithmetic simplified
+    /// (see `optimize::simplify`) before compiling. `params` name constant
+    /// nodes whose values a sweep overrides; they are kept as they are.
+    pub fn new(
+        nodes: Vec<Node>,
+        root: NodeId,
+        outputs: Vec<(String, NodeId)>,
+        params: Vec<(String, NodeId)>,
+        inputs: Option<Vec<String>>,
+        simplify: bool,
+    ) -> Result<Self, String> {
+        let (output_names, outputs): (Vec<String>, Vec<NodeId>) = outputs.into_iter().unzip();
+        let (param_names, params): (Vec<String>, Vec<NodeId>) = params.into_iter().unzip();
+        if let Some(&id) = std::iter::once(&root).chain(&outputs).chain(&params).find(|&&id| id >= nodes.len()) {
+            return Err(format!("Node index {} is out of range for a graph of {} nodes", id, nodes.len()));
+        }
+        if let Some(name) = output_names.iter().find(|&name| name == "row" || name == "trigger") {
+            return Err(format!("Output name {} is reserved", name));
+        }
+        if let Some((name, _)) = param_names.iter().zip(&params).find(|&(_, &id)| !matches!(nodes[id], Node::Const { .. })) {
+            return Err(format!("Parameter {} is not a constant", name));
+        }
+
+        // Parameters are roots too, so an unused one still has a slot to set
+        let roots: Vec<NodeId> = std::iter::once(root).chain(outputs.iter().copied()).chain(params.iter().copied()).collect();
+        let (mut nodes, mut map) = optimize::prune(&nodes, &roots)?;
+        let mut simplified = 0;
+        if simplify {
+            let pinned: Vec<NodeId> = params.iter().map(|&id| map[id]).collect();
+            let (folded, fold_map) = optimize::simplify(&nodes, &roots.iter().map(|&id| map[id]).collect::<Vec<_>>(), &pinned);
+            let roots: Vec<NodeId> = roots.iter().map(|&id| fold_map[map[id]]).collect();
+            let (pruned, prune_map) = optimize::prune(&folded, &roots)?;
+            simplified = nodes.len().saturating_sub(pruned.len());
+            map = map.iter().map(|&id| if id == usize::MAX { id } else { prune_map[fold_map[id]] }).collect();
+            nodes = pruned;
+        }
+        let root = map[root];
+        let outputs = outputs.iter().map(|&id| map[id]).collect();
+        let params = params.iter().map(|&id| map[id]).collect();
+
+        let plan = Plan::compile(&nodes, inputs)?;
+        Ok(Self { plan, root, outputs, output_names, params, param_names, simplified })
+    }
+
+    /// Wrap an already compiled plan, e.g. one loaded from a binary file.
+    pub fn from_plan(plan: Plan, root: NodeId, outputs: Vec<(String, NodeId)>) -> Result<Self, String> {
+        plan.validate()?;
+        let (output_names, outputs): (Vec<String>, Vec<NodeId>) = outputs.into_iter().unzip();
+        if let Some(&id) = std::iter::once(&root).chain(&outputs).find(|&&id| id >= plan.len()) {
+            return Err(format!("Node index {} is out of range for a graph of {} nodes", id, plan.len()));
+        }
+        Ok(Self { plan, root, outputs, output_names, params: Vec::new(), param_names: Vec::new(), simplified: 0 })
+    }
+}
+
+/// Evaluation state carried from one chunk of rows to the next.
+pub struct RunState {
+    /// Last emitted trigger value
+    pub prev_trigger: Option<f64>,
+    /// Rows consumed by earlier chunks; emitted row indices continue from here
+    pub row_offset: usize,
+    /// Node values after the last row (constants are filled in up front)
+    pub values: Vec<f64>,
+    /// Input values of the last row, by slot (empty before the first row)
+    pub last_inputs: Vec<f64>,
+}
+
+impl RunState {
+    pub fn new(program: &Program) -> Self {
+        let plan = &program.plan;
+        let mut values = vec![0.0; plan.len()];
+        for i in 0..plan.len() {
+            if plan.ops[i] == Op::Const {
+                values[i] = plan.consts[plan.a[i] as usize];
+            }
+        }
+        Self { prev_trigger: None, row_offset: 0, values, last_inputs: Vec::new() }
+    }
+}
+
+/// Rows sampled on trigger changes, stored column-wise.
+pub struct Emissions {
+    pub rows: Vec<usize>,
+    pub triggers: Vec<f64>,
+    pub outputs: Vec<Vec<f64>>,
+}
+
+impl Emissions {
+    pub fn new(n_outputs: usize) -> Self {
+        Self {
+            rows: Vec::new(),
+            triggers: Vec::new(),
+            outputs: vec![Vec::new(); n_outputs],
+        }
+    }
+
+    pub fn len(&self) -> usize {
+        self.rows.len()
+    }
+
+    /// Record `row` (a global row index) if its trigger differs from the last
+    /// emitted one.
+    #[inline]
+    pub fn sample(&mut self, prev_trigger: &mut Option<f64>, row: usize, values: &[f64], program: &Program) {
+        let trigger = values[program.root];
+        if prev_trigger.map_or(true, |p| p != trigger) {
+            self.push(row, trigger, program.outputs.iter().map(|&id| values[id]));
+            *prev_trigger = Some(trigger);
+        }
+    }
+
+    /// Append `other`'s emissions from index `from` on.
+    pub fn extend_from(&mut self, other: &Emissions, from: usize) {
+        self.rows.extend_from_slice(&other.rows[from..]);
+        self.triggers.extend_from_slice(&other.triggers[from..]);
+        for (column, values) in self.outputs.iter_mut().zip(&other.outputs) {
+            column.extend_from_slice(&values[from..]);
+        }
+    }
+
+    /// Record an emitted row unconditionally.
+    #[inline]
+    pub fn push(&mut self, row: usize, trigger: f64, outputs: impl Iterator<Item = f64>) {
+        self.rows.push(row);
+        self.triggers.push(trigger);
+        for (column, value) in self.outputs.iter_mut().zip(outputs) {
+            column.push(value);
+        }
+    }
+}
+
+/// An evaluation strategy. Engines are built once per Sampler and may
+/// precompute whatever they need from the program; anything that changes
+/// while rows are evaluated lives in the caller's `RunState`.
+pub trait Engine: Send + Sync {
+    fn name(&self) -> &'static str;
+
+    /// Evaluate `n_rows` rows, reading input slot `s` from `columns[s]` and
+    /// continuing from `state`.
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions);
+
+    /// Evaluate one chunk and advance `state` past it.
+    fn run_chunk(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        self.run(program, columns, n_rows, state, out);
+        state.row_offset += n_rows;
+    }
+}
+
+/// Evaluate rows that interleave independent partitions, such as the symbols
+/// of a multi-symbol feed: row r belongs to partition `keys[r]`, and each
+/// partition is run by `engine` with its own trigger and node state, as if
+/// its rows had been run on their own. Partitions are evaluated in parallel.
+///
+/// Returns the emissions in row order, with rows indexed into `columns`
+/// and the partition key of each emission.
+pub fn run_partitioned(program: &Program, engine: &dyn Engine, columns: &[&[f64]], keys: &[i64]) -> (Emissions, Vec<i64>) {
+    // Row indices of each partition, partitions in order of first appearance
+    let mut partitions: Vec<(i64, Vec<usize>)> = Vec::new();
+    let mut index: HashMap<i64, usize> = HashMap::new();
+    for (row, &key) in keys.iter().enumerate() {
+        let p = *index.entry(key).or_insert_with(|| {
+            partitions.push((key, Vec::new()));
+            partitions.len() - 1
+        });
+        partitions[p].1.push(row);
+    }
+
+    let results: Vec<Emissions> = partitions
+        .par_iter()
+        .map(|(_, rows)| {
+            let gathered: Vec<Vec<f64>> = columns.iter()
+                .map(|column| rows.iter().map(|&row| column[row]).collect())
+                .collect();
+            let gathered: Vec<&[f64]> = gathered.iter().map(Vec::as_slice).collect();
+            let mut state = RunState::new(program);
+            let mut emissions = Emissions::new(program.outputs.len());
+            engine.run_chunk(program, &gathered, rows.len(), &mut state, &mut emissions);
+            for row in &mut emissions.rows {
+                *row = rows[*row];
+            }
+            emissions
+        })
+        .collect();
+
+    // Merge the partitions back into row order
+    let mut order: Vec<(usize, usize, usize)> = results.iter()
+        .enumerate()
+        .flat_map(|(p, emissions)| emissions.rows.iter().enumerate().map(move |(e, &row)| (row, p, e)))
+        .collect();
+    order.sort_unstable();
+    let mut out = Emissions::new(program.outputs.len());
+    let mut out_keys = Vec::with_capacity(order.len());
+    for (row, p, e) in order {
+        let emissions = &results[p];
+        out.push(row, emissions.triggers[e], emissions.outputs.iter().map(|column| column[e]));
+        out_keys.push(partitions[p].0);
+    }
+    (out, out_keys)
+}
+
+// ===========================================================================
+// REGISTRY
+// ===========================================================================
+
+/// Registry entry tying an engine name to its constructor.
+pub struct EngineBuilder {
+    pub name: &'static str,
+    /// Older names that still select this engine
+    pub aliases: &'static [&'static str],
+    pub build: fn(&Program) -> Box<dyn Engine>,
+}
+
+/// All available engines. To add one, implement `Engine` and list it here.
+pub static ENGINES: &[EngineBuilder] = &[
+    EngineBuilder { name: "sweep", aliases: &["topological"], build: |p| Box::new(SweepEngine::new(p)) },
+    EngineBuilder { name: "tape", aliases: &[], build: |p| Box::new(TapeEngine::new(p)) },
+    EngineBuilder { name: "block", aliases: &[], build: |_| Box::new(BlockEngine) },
+    EngineBuilder { name: "incremental", aliases: &["lazy"], build: |p| Box::new(IncrementalEngine::new(p)) },
+    EngineBuilder { name: "parallel", aliases: &[], build: |_| Box::new(ParallelEngine) },
+    EngineBuilder { name: "level", aliases: &[], build: |p| Box::new(LevelEngine::new(p)) },
+];
+
+/// Engine used when a Sampler does not ask for one.
+pub const DEFAULT_ENGINE: &str = "sweep";
+
+/// Build the engine registered as `name` (or one of its aliases).
+pub fn create(name: &str, program: &Program) -> Result<Box<dyn Engine>, String> {
+    ENGINES.iter()
+        .find(|b| b.name == name || b.aliases.contains(&name))
+        .map(|b| (b.build)(program))
+        .ok_or_else(|| format!("Unknown engine: {} (available: {})", name, names().join(", ")))
+}
+
+/// Names of all registered engines.
+pub fn names() -> Vec<&'static str> {
+    ENGINES.iter().map(|b| b.name).collect()
+}
+
+// ===========================================================================
+// SWEEP - match on the Node enum for every node on every row
+// ===========================================================================
+
+pub struct SweepEngine {
+    nodes: Vec<Node>,
+}
+
+impl SweepEngine {
+    pub fn new(program: &Program) -> Self {
+        Self { nodes: program.plan.to_nodes() }
+    }
+}
+
+impl Engine for SweepEngine {
+    fn name(&self) -> &'static str {
+        "sweep"
+    }
+
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let RunState { prev_trigger, row_offset, values, .. } = state;
+
+        for row in 0..n_rows {
+            for (i, node) in self.nodes.iter().enumerate() {
+                values[i] = match node {
+                    Node::Input { .. } => columns[program.plan.a[i] as usize][row],
+                    Node::Const { value } => *value,
+                    Node::Add { children } => children.iter().map(|&id| values[id]).sum(),
+                    Node::Mul { children } => children.iter().map(|&id| values[id]).product(),
+                    Node::Div { left, right } => {
+                        let l = values[*left];
+                        let r = values[*right];
+                        if r == 0.0 { f64::NAN } else { l / r }
+                    }
+                };
+            }
+            out.sample(prev_trigger, *row_offset + row, values, program);
+        }
+    }
+}
+
+// ===========================================================================
+// TAPE - run the flat instruction plan
+// ===========================================================================
+
+pub struct TapeEngine {
+    /// Instructions that vary per row; constants are already in `RunState`
+    code: Vec<u32>,
+}
+
+impl TapeEngine {
+    pub fn new(program: &Program) -> Self {
+        let code = (0..program.plan.len())
+            .filter(|&i| program.plan.ops[i] != Op::Const)
+            .map(|i| i as u32)
+            .collect();
+        Self { code }
+    }
+}
+
+impl Engine for TapeEngine {
+    fn name(&self) -> &'static str {
+        "tape"
+    }
+
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let plan = &program.plan;
+        let RunState { prev_trigger, row_offset, values, .. } = state;
+
+        for row in 0..n_rows {
+            for &i in &self.code {
+                let i = i as usize;
+                values[i] = plan.eval(i, values, columns, row);
+            }
+            out.sample(prev_trigger, *row_offset + row, values, program);
+        }
+    }
+}
+
+// ===========================================================================
+// BLOCK - evaluate one node at a time over a block of rows
+// ===========================================================================
+
+/// Most rows per block: enough for long vectorized loops.
+const BLOCK_ROWS: usize = 1024;
+
+/// Fewest rows per block, however many nodes the graph has.
+const MIN_BLOCK_ROWS: usize = 16;
+
+/// Target size of a block's node columns, so that they stay cache-resident.
+const BLOCK_BYTES: usize = 256 * 1024;
+
+/// Released block buffers kept per thread for reuse.
+const POOLED_BLOCKS: usize = 2;
+
+thread_local! {
+    /// Block buffers released on this thread, so that a worker reuses one
+    /// allocation across the chunks, partitions and batches it evaluates.
+    static BLOCK_POOL: RefCell<Vec<Vec<f64>>> = RefCell::new(Vec::new());
+}
+
+/// Node columns for one block of rows. Input nodes have no column (they are
+/// read straight from the input); every other node has `rows` values, and
+/// constant columns are filled in up front.
+pub struct Block {
+    rows: usize,
+    /// Column of each node; inputs have none
+    slots: Vec<u32>,
+    values: Vec<f64>,
+}
+
+impl Block {
+    pub fn new(plan: &Plan) -> Self {
+        let mut slots = vec![u32::MAX; plan.len()];
+        let mut n_slots = 0;
+        for (i, slot) in slots.iter_mut().enumerate() {
+            if plan.ops[i] != Op::Input {
+                *slot = n_slots as u32;
+                n_slots += 1;
+            }
+        }
+        let rows = Self::rows_for(plan);
+
+        let mut values = BLOCK_POOL.with(|pool| pool.borrow_mut().pop()).unwrap_or_default();
+        values.resize(n_slots * rows, 0.0);
+        for i in 0..plan.len() {
+            if plan.ops[i] == Op::Const {
+                let slot = slots[i] as usize;
+                values[slot * rows..(slot + 1) * rows].fill(plan.consts[plan.a[i] as usize]);
+            }
+        }
+        Self { rows, slots, values }
+    }
+
+    /// Rows per block for `plan`: as many as fit `BLOCK_BYTES`, within
+    /// `MIN_BLOCK_ROWS..=BLOCK_ROWS`.
+    pub fn rows_for(plan: &Plan) -> usize {
+        let n_slots = plan.ops.iter().filter(|&&op| op != Op::Input).count();
+        (BLOCK_BYTES / 8 / n_slots.max(1)).clamp(MIN_BLOCK_ROWS, BLOCK_ROWS)
+    }
+
+    /// Most rows `eval` takes at once.
+    pub fn rows(&self) -> usize {
+        self.rows
+    }
+
+    /// Node `id`'s values for the rows last evaluated.
+    #[inline]
+    pub fn column<'a>(&'a self, plan: &Plan, columns: &[&'a [f64]], id: usize, start: usize, len: usize) -> &'a [f64] {
+        Self::read(plan, &self.slots, self.rows, &self.values, columns, id, start, len)
+    }
+
+    /// Node `id`'s values, from its input column or from `done`, the node
+    /// columns before the one being written.
+    #[inline]
+    fn read<'a>(plan: &Plan, slots: &[u32], rows: usize, done: &'a [f64], columns: &[&'a [f64]], id: usize, start: usize, len: usize) -> &'a [f64] {
+        if plan.ops[id] == Op::Input {
+            &columns[plan.a[id] as usize][start..start + len]
+        } else {
+            let at = slots[id] as usize * rows;
+            &done[at..at + len]
+        }
+    }
+
+    /// Evaluate every node over rows `start..start + len` (at most `rows`).
+    pub fn eval(&mut self, plan: &Plan, columns: &[&[f64]], start: usize, len: usize) {
+        let Self { rows, slots, values } = self;
+        let rows = *rows;
+        for i in 0..plan.len() {
+            if matches!(plan.ops[i], Op::Input | Op::Const) {
+                continue;
+            }
+            // Children precede node i, so split the buffer at its column
+            let (done, rest) = values.split_at_mut(slots[i] as usize * rows);
+            let dst = &mut rest[..len];
+            let col = |id: u32| Self::read(plan, slots, rows, done, columns, id as usize, start, len);
+
+            match plan.ops[i] {
+                Op::Input | Op::Const => {}
+                Op::Add => match plan.children_of(i).split_first() {
+                    Some((&first, others)) => {
+                        dst.copy_from_slice(col(first));
+                        for &c in others {
+                            for (d, &v) in dst.iter_mut().zip(col(c)) {
+                                *d += v;
+                            }
+                        }
+                    }
+                    None => dst.fill(-0.0),
+                },
+                Op::Mul => match plan.children_of(i).split_first() {
+                    Some((&first, others)) => {
+                        dst.copy_from_slice(col(first));
+                        for &c in others {
+                            for (d, &v) in dst.iter_mut().zip(col(c)) {
+                                *d *= v;
+                            }
+                        }
+                    }
+                    None => dst.fill(1.0),
+                },
+                Op::Div => {
+                    let (l, r) = (col(plan.a[i]), col(plan.b[i]));
+                    for ((d, &l), &r) in dst.iter_mut().zip(l).zip(r) {
+                        *d = if r == 0.0 { f64::NAN } else { l / r };
+                    }
+                }
+            }
+        }
+    }
+}
+
+impl Drop for Block {
+    fn drop(&mut self) {
+        let values = std::mem::take(&mut self.values);
+        let _ = BLOCK_POOL.try_with(|pool| {
+            let mut pool = pool.borrow_mut();
+            if pool.len() < POOLED_BLOCKS {
+                pool.push(values);
+            }
+        });
+    }
+}
+
+pub struct BlockEngine;
+
+impl Engine for BlockEngine {
+    fn name(&self) -> &'static str {
+        "block"
+    }
+
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let plan = &program.plan;
+        let mut block = Block::new(plan);
+
+        for start in (0..n_rows).step_by(block.rows()) {
+            let len = block.rows().min(n_rows - start);
+            block.eval(plan, columns, start, len);
+
+            // One pass over the trigger column
+            let col = |id: usize| block.column(plan, columns, id, start, len);
+            let triggers = col(program.root);
+            for (k, &trigger) in triggers.iter().enumerate() {
+                if state.prev_trigger.map_or(true, |p| p != trigger) {
+                    out.push(state.row_offset + start + k, trigger, program.outputs.iter().map(|&id| col(id)[k]));
+                    state.prev_trigger = Some(trigger);
+                }
+            }
+        }
+    }
+}
+
+// ===========================================================================
+// GROUP - several triggers over one merged program in a single pass
+// ===========================================================================
+
+/// One member of a merged program: the positions in `Program::outputs` of
+/// its trigger and of its outputs.
+pub struct Member {
+    pub trigger: usize,
+    pub outputs: std::ops::Range<usize>,
+}
+
+/// Evaluate a program merged from several graphs once over the rows,
+/// sampling each member on its own trigger. `prev_triggers` holds each
+/// member's last emitted trigger and is updated.
+pub fn run_group(program: &Program, members: &[Member], columns: &[&[f64]], n_rows: usize, prev_triggers: &mut [Option<f64>]) -> Vec<Emissions> {
+    let plan = &program.plan;
+    let mut block = Block::new(plan);
+    let mut out: Vec<Emissions> = members.iter().map(|m| Emissions::new(m.outputs.len())).collect();
+
+    for start in (0..n_rows).step_by(block.rows()) {
+        let len = block.rows().min(n_rows - start);
+        block.eval(plan, columns, start, len);
+
+        let col = |id: usize| block.column(plan, columns, id, start, len);
+        for ((member, emissions), prev_trigger) in members.iter().zip(&mut out).zip(prev_triggers.iter_mut()) {
+            let triggers = col(program.outputs[member.trigger]);
+            let outputs = &program.outputs[member.outputs.clone()];
+            for (k, &trigger) in triggers.iter().enumerate() {
+                if prev_trigger.map_or(true, |p| p != trigger) {
+                    emissions.push(start + k, trigger, outputs.iter().map(|&id| col(id)[k]));
+                    *prev_trigger = Some(trigger);
+                }
+            }
+        }
+    }
+    out
+}
+
+// ===========================================================================
+// PARAMETERS - many parameter sets over the rows in one pass
+// ===========================================================================
+
+/// A program split for sweeping its parameters. Nodes that depend on no
+/// parameter are evaluated once per row by `shared`; the rest run in `lanes`
+/// over rows x sets, one lane per (row, parameter set), reading the shared
+/// values they need and the parameter values as input columns.
+pub struct ParamSweep {
+    /// Shared nodes read by the lanes (and shared roles), as its outputs;
+    /// None when the lanes read none
+    shared: Option<Program>,
+    /// Input slots: each shared value, then each parameter
+    lanes: Program,
+    params: usize,
+}
+
+impl ParamSweep {
+    pub fn new(program: &Program) -> Result<Self, String> {
+        let nodes = program.plan.to_nodes();
+        let mut dependent = vec![false; nodes.len()];
+        for &id in &program.params {
+            dependent[id] = true;
+        }
+        for (id, node) in nodes.iter().enumerate() {
+            dependent[id] = dependent[id] || optimize::children(node).any(|c| dependent[c]);
+        }
+
+        // Shared values the lanes read: children of parameter-dependent
+        // nodes, and roles that depend on no parameter. Constants stay put.
+        let mut read = vec![false; nodes.len()];
+        for (id, node) in nodes.iter().enumerate() {
+            if dependent[id] {
+                for child in optimize::children(node) {
+                    read[child] = true;
+                }
+            }
+        }
+        for &id in std::iter::once(&program.root).chain(&program.outputs) {
+            read[id] = true;
+        }
+        let boundary: Vec<NodeId> = (0..nodes.len())
+            .filter(|&id| read[id] && !dependent[id] && !matches!(nodes[id], Node::Const { .. }))
+            .collect();
+
+        let shared = match boundary.first() {
+            Some(&first) => {
+                let outputs = boundary.iter().enumerate().map(|(j, &id)| (format!("shared {}", j), id)).collect();
+                Some(Program::new(nodes.clone(), first, outputs, Vec::new(), Some(program.plan.inputs.clone()), false)?)
+            }
+            None => None,
+        };
+
+        let mut lane_nodes = nodes;
+        let mut schema = Vec::with_capacity(boundary.len() + program.params.len());
+        for (j, &id) in boundary.iter().enumerate() {
+            schema.push(format!("shared {}", j));
+            lane_nodes[id] = Node::Input { name: schema[j].clone() };
+        }
+        for (p, &id) in program.params.iter().enumerate() {
+            schema.push(format!("param {}", p));
+            lane_nodes[id] = Node::Input { name: format!("param {}", p) };
+        }
+        let outputs = program.output_names.iter().cloned().zip(program.outputs.iter().copied()).collect();
+        let lanes = Program::new(lane_nodes, program.root, outputs, Vec::new(), Some(schema), false)?;
+
+        Ok(Self { shared, lanes, params: program.params.len() })
+    }
+
+    /// Evaluate every parameter set in `sets` (one value per parameter, in
+    /// `Program::params` order) over the rows, each sampled on its own
+    /// trigger. Each block of rows evaluates the shared nodes once, then
+    /// feeds them to every batch of sets, a block's worth of lanes per
+    /// batch; the batches run in parallel.
+    pub fn run(&self, sets: &[Vec<f64>], columns: &[&[f64]], n_rows: usize) -> Vec<Emissions> {
+        let mut batches: Vec<Batch> = sets.chunks(Block::rows_for(&self.lanes.plan))
+            .map(|sets| self.batch(sets))
+            .collect();
+        let mut shared_block = self.shared.as_ref().map(|shared| Block::new(&shared.plan));
+        let step = shared_block.as_ref().map_or(BLOCK_ROWS, Block::rows);
+
+        for start in (0..n_rows).step_by(step) {
+            let len = step.min(n_rows - start);
+            let shared: Vec<&[f64]> = match (&self.shared, &mut shared_block) {
+                (Some(shared), Some(block)) => {
+                    block.eval(&shared.plan, columns, start, len);
+                    shared.outputs.iter().map(|&id| block.column(&shared.plan, columns, id, start, len)).collect()
+                }
+                _ => Vec::new(),
+            };
+            batches.par_iter_mut().for_each(|batch| self.run_rows(batch, &shared, start, len));
+        }
+        batches.into_iter().flat_map(|batch| batch.out).collect()
+    }
+
+    fn batch<'a>(&self, sets: &'a [Vec<f64>]) -> Batch<'a> {
+        let block = Block::new(&self.lanes.plan);
+        let width = sets.len();
+        let rows = block.rows() / width;
+        let n_shared = self.lanes.plan.inputs.len() - self.params;
+        let mut columns = vec![vec![0.0; rows * width]; n_shared];
+        for p in 0..self.params {
+            columns.push((0..rows).flat_map(|_| sets.iter().map(move |set| set[p])).collect());
+        }
+        Batch {
+            sets,
+            block,
+            columns,
+            prev_triggers: vec![None; width],
+            out: (0..width).map(|_| Emissions::new(self.lanes.outputs.len())).collect(),
+        }
+    }
+
+    /// Evaluate rows `start..start + len` for one batch of sets, given the
+    /// shared values of those rows.
+    fn run_rows(&self, batch: &mut Batch, shared: &[&[f64]], start: usize, len: usize) {
+        let plan = &self.lanes.plan;
+        let width = batch.sets.len();
+        let rows = batch.block.rows() / width;
+
+        for first in (0..len).step_by(rows) {
+            let n = rows.min(len - first);
+            for (column, values) in batch.columns.iter_mut().zip(shared) {
+                for (row_lanes, &value) in column.chunks_mut(width).zip(&values[first..first + n]) {
+                    row_lanes.fill(value);
+                }
+            }
+
+            let n_lanes = n * width;
+            let inputs: Vec<&[f64]> = batch.columns.iter().map(|column| &column[..n_lanes]).collect();
+            batch.block.eval(plan, &inputs, 0, n_lanes);
+
+            let block = &batch.block;
+            let col = |id: usize| block.column(plan, &inputs, id, 0, n_lanes);
+            for (lane, &trigger) in col(self.lanes.root).iter().enumerate() {
+                let set = lane % width;
+                let prev_trigger = &mut batch.prev_triggers[set];
+                if prev_trigger.map_or(true, |p| p != trigger) {
+                    let row = start + first + lane / width;
+                    batch.out[set].push(row, trigger, self.lanes.outputs.iter().map(|&id| col(id)[lane]));
+                    *prev_trigger = Some(trigger);
+                }
+            }
+        }
+    }
+}
+
+/// Evaluation state of one batch of parameter sets.
+struct Batch<'a> {
+    sets: &'a [Vec<f64>],
+    block: Block,
+    /// Lane columns, rows x sets: shared values are repeated across the sets
+    /// of a row, parameter values across the rows
+    columns: Vec<Vec<f64>>,
+    prev_triggers: Vec<Option<f64>>,
+    out: Vec<Emissions>,
+}
+
+// ===========================================================================
+// INCREMENTAL - recompute only the cones of inputs that changed
+// ===========================================================================
+
+pub struct IncrementalEngine {
+    /// Downstream cone of each input slot (including its Input nodes), in
+    /// evaluation order, stored CSR-style: slot s owns
+    /// `cone_nodes[cone_offsets[s]..cone_offsets[s + 1]]`.
+    cone_offsets: Vec<usize>,
+    cone_nodes: Vec<u32>,
+}
+
+impl IncrementalEngine {
+    pub fn new(program: &Program) -> Self {
+        let plan = &program.plan;
+        let n = plan.len();
+
+        // Reverse edges: node -> nodes that read it
+        let mut dependents: Vec<Vec<u32>> = vec![Vec::new(); n];
+        for i in 0..n {
+            let (a, b) = (plan.a[i], plan.b[i]);
+            match plan.ops[i] {
+                Op::Add | Op::Mul => {
+                    for &c in plan.children_of(i) {
+                        dependents[c as usize].push(i as u32);
+                    }
+                }
+                Op::Div => {
+                    dependents[a as usize].push(i as u32);
+                    dependents[b as usize].push(i as u32);
+                }
+                Op::Input | Op::Const => {}
+            }
+        }
+
+        let mut cone_offsets = vec![0];
+        let mut cone_nodes = Vec::new();
+        let mut seen = vec![usize::MAX; n];
+        for slot in 0..plan.inputs.len() {
+            let start = cone_nodes.len();
+            let mut stack: Vec<u32> = (0..n)
+                .filter(|&i| plan.ops[i] == Op::Input && plan.a[i] as usize == slot)
+                .map(|i| i as u32)
+                .collect();
+            while let Some(i) = stack.pop() {
+                if seen[i as usize] == slot {
+                    continue;
+                }
+                seen[i as usize] = slot;
+                cone_nodes.push(i);
+                stack.extend(&dependents[i as usize]);
+            }
+            cone_nodes[start..].sort_unstable();
+            cone_offsets.push(cone_nodes.len());
+        }
+
+        Self { cone_offsets, cone_nodes }
+    }
+
+    fn cone(&self, slot: usize) -> &[u32] {
+        &self.cone_nodes[self.cone_offsets[slot]..self.cone_offsets[slot + 1]]
+    }
+}
+
+impl Engine for IncrementalEngine {
+    fn name(&self) -> &'static str {
+        "incremental"
+    }
+
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let plan = &program.plan;
+        let RunState { prev_trigger, row_offset, values, last_inputs } = state;
+        let mut stamp = vec![0usize; plan.len()];
+        let mut dirty: Vec<u32> = Vec::new();
+
+        for row in 0..n_rows {
+            if row == 0 && last_inputs.is_empty() {
+                for i in 0..plan.len() {
+                    values[i] = plan.eval(i, values, columns, row);
+                }
+                out.sample(prev_trigger, *row_offset + row, values, program);
+                continue;
+            }
+
+            // Union of the cones of every slot whose value changed bitwise
+            dirty.clear();
+            let mut changed = 0;
+            for (slot, column) in columns.iter().enumerate() {
+                let previous = if row == 0 { last_inputs[slot] } else { column[row - 1] };
+                if column[row].to_bits() != previous.to_bits() {
+                    changed += 1;
+                    for &i in self.cone(slot) {
+                        if stamp[i as usize] != row + 1 {
+                            stamp[i as usize] = row + 1;
+                            dirty.push(i);
+                        }
+                    }
+                }
+            }
+            if changed > 1 {
+                dirty.sort_unstable();
+            }
+
+            for &i in &dirty {
+                let i = i as usize;
+                values[i] = plan.eval(i, values, columns, row);
+            }
+            out.sample(prev_trigger, *row_offset + row, values, program);
+        }
+
+        if n_rows > 0 {
+            *last_inputs = columns.iter().map(|column| column[n_rows - 1]).collect();
+        }
+    }
+}
+
+// ===========================================================================
+// PARALLEL - evaluate chunks of rows on all cores, then stitch the triggers
+// ===========================================================================
+
+/// Rows per parallel task: enough blocks to amortize scheduling, small
+/// enough that a day of quotes splits into many more tasks than cores.
+const PARALLEL_ROWS: usize = 16 * BLOCK_ROWS;
+
+/// Every node is a pure function of its row's inputs, so chunks of rows can
+/// be evaluated independently on rayon's work-stealing pool. Only the
+/// trigger comparison links neighbouring rows, and since the last emitted
+/// trigger always equals the previous row's trigger, a chunk's first row is
+/// emitted exactly when its trigger differs from the previous chunk's last.
+pub struct ParallelEngine;
+
+impl Engine for ParallelEngine {
+    fn name(&self) -> &'static str {
+        "parallel"
+    }
+
+    fn run(&self, program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let n_chunks = (n_rows + PARALLEL_ROWS - 1) / PARALLEL_ROWS;
+        let row_offset = state.row_offset;
+
+        // Each chunk runs as if nothing came before it, so it always emits its
+        // first row; the stitch below decides whether that emission stands.
+        let chunks: Vec<(Emissions, Option<f64>)> = (0..n_chunks)
+            .into_par_iter()
+            .map(|c| {
+                let start = c * PARALLEL_ROWS;
+                let len = PARALLEL_ROWS.min(n_rows - start);
+                let columns: Vec<&[f64]> = columns.iter().map(|column| &column[start..start + len]).collect();
+                let mut chunk_state = RunState {
+                    prev_trigger: None,
+                    row_offset: row_offset + start,
+                    values: Vec::new(),
+                    last_inputs: Vec::new(),
+                };
+                let mut emissions = Emissions::new(program.outputs.len());
+                BlockEngine.run(program, &columns, len, &mut chunk_state, &mut emissions);
+                (emissions, chunk_state.prev_trigger)
+            })
+            .collect();
+
+        for (emissions, last_trigger) in chunks {
+            let repeated = state.prev_trigger == emissions.triggers.first().copied();
+            out.extend_from(&emissions, repeated as usize);
+            state.prev_trigger = last_trigger;
+        }
+    }
+}
+
+// ===========================================================================
+// LEVEL - evaluate each wide topological level of a row in parallel
+// ===========================================================================
+
+/// Levels with at least this many nodes are split across the thread pool;
+/// narrower ones are cheaper to run serially than to schedule.
+const PARALLEL_WIDTH: usize = 4096;
+
+/// Nodes per parallel task within a wide level.
+const LEVEL_TASK: usize = 1024;
+
+/// Nodes on the same level (longest path from an input or constant) do not
+/// read each other, so a level can be evaluated in any order. The engine
+/// recompiles the plan with nodes sorted by level, making every level a
+/// contiguous range of values that can be written in parallel while the
+/// levels before it are read.
+pub struct LevelEngine {
+    /// The program's plan, renumbered in level order
+    plan: Plan,
+    /// Position range of each level
+    levels: Vec<(usize, usize)>,
+    root: usize,
+    outputs: Vec<usize>,
+}
+
+impl LevelEngine {
+    pub fn new(program: &Program) -> Self {
+        let nodes = program.plan.to_nodes();
+        let mut level = vec![0usize; nodes.len()];
+        for (id, node) in nodes.iter().enumerate() {
+            level[id] = optimize::children(node).map(|c| level[c] + 1).max().unwrap_or(0);
+        }
+
+        let mut order: Vec<NodeId> = (0..nodes.len()).collect();
+        order.sort_by_key(|&id| level[id]);
+        let mut position = vec![0; nodes.len()];
+        for (p, &id) in order.iter().enumerate() {
+            position[id] = p;
+        }
+        let reordered: Vec<Node> = order.iter().map(|&id| optimize::remap(&nodes[id], &position)).collect();
+        let plan = Plan::compile(&reordered, Some(program.plan.inputs.clone()))
+            .expect("reordering keeps the input schema");
+
+        let mut levels: Vec<(usize, usize)> = Vec::new();
+        for (p, &id) in order.iter().enumerate() {
+            match levels.last_mut() {
+                Some(range) if level[order[range.0]] == level[id] => range.1 = p + 1,
+                _ => levels.push((p, p + 1)),
+            }
+        }
+
+        Self {
+            plan,
+            levels,
+            root: position[program.root],
+            outputs: program.outputs.iter().map(|&id| position[id]).collect(),
+        }
+    }
+}
+
+impl Engine for LevelEngine {
+    fn name(&self) -> &'static str {
+        "level"
+    }
+
+    fn run(&self, _program: &Program, columns: &[&[f64]], n_rows: usize, state: &mut RunState, out: &mut Emissions) {
+        let plan = &self.plan;
+        let mut values = vec![0.0; plan.len()];
+
+        for row in 0..n_rows {
+            for &(start, end) in &self.levels {
+                let (done, rest) = values.split_at_mut(start);
+                let level = &mut rest[..end - start];
+                if level.len() >= PARALLEL_WIDTH {
+                    let done = &*done;
+                    level.par_chunks_mut(LEVEL_TASK).enumerate().for_each(|(task, chunk)| {
+                        let first = start + task * LEVEL_TASK;
+                        for (k, value) in chunk.iter_mut().enumerate() {
+                            *value = plan.eval(first + k, done, columns, row);
+                        }
+                    });
+                } else {
+                    for (k, value) in level.iter_mut().enumerate() {
+                        *value = plan.eval(start + k, done, columns, row);
+                    }
+                }
+            }
+
+            let trigger = values[self.root];
+            if state.prev_trigger.map_or(true, |p| p != trigger) {
+                out.push(state.row_offset + row, trigger, self.outputs.iter().map(|&p| values[p]));
+                state.prev_trigger = Some(trigger);
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    /// Deterministic pseudo-random values drawn from `choices`.
+    fn column(n_rows: usize, seed: u64, choices: &[f64]) -> Vec<f64> {
+        let mut state = seed;
+        (0..n_rows)
+            .map(|_| {
+                state = state.wrapping_mul(6364136223846793005).wrapping_add(1442695040888963407);
+                choices[(state >> 33) as usize % choices.len()]
+            })
+            .collect()
+    }
+
+    fn input(name: &str) -> Node {
+        Node::Input { name: name.to_string() }
+    }
+
+    fn named(outputs: &[NodeId]) -> Vec<(String, NodeId)> {
+        outputs.iter().enumerate().map(|(i, &id)| (format!("output{}", i), id)).collect()
+    }
+
+    /// A quote-like graph whose trigger is a ratio over a column with zeros
+    /// (so NaN triggers) and whose inputs include both signed zeros.
+    fn graph() -> Program {
+        let nodes = vec![
+            input("a"),                                   // 0
+            input("b"),                                   // 1
+            input("c"),                                   // 2
+            Node::Const { value: 0.5 },                   // 3
+            Node::Mul { children: vec![0, 3] },           // 4
+            Node::Add { children: vec![4, 1] },           // 5
+            Node::Div { left: 5, right: 2 },              // 6: trigger
+            Node::Add { children: vec![0, 1, 2] },        // 7
+            Node::Mul { children: vec![7, 7] },           // 8
+            Node::Div { left: 8, right: 3 },              // 9
+            Node::Add { children: vec![] },               // 10
+            Node::Mul { children: vec![] },               // 11
+        ];
+        Program::new(nodes, 6, named(&[5, 9, 10, 11]), Vec::new(), None, false).unwrap()
+    }
+
+    fn columns(n_rows: usize) -> Vec<Vec<f64>> {
+        let choices = [0.0, -0.0, 1.0, -1.0, 2.5];
+        vec![column(n_rows, 1, &choices), column(n_rows, 2, &choices), column(n_rows, 3, &choices)]
+    }
+
+    /// Run `engine` over `columns` in chunks of at most `chunk` rows,
+    /// carrying state from one chunk to the next.
+    fn run(engine: &str, program: &Program, columns: &[Vec<f64>], chunk: usize) -> Emissions {
+        let engine = create(engine, program).unwrap();
+        let n_rows = columns.first().map_or(0, Vec::len);
+        let mut state = RunState::new(program);
+        let mut out = Emissions::new(program.outputs.len());
+        for start in (0..n_rows).step_by(chunk.max(1)) {
+            let len = chunk.min(n_rows - start);
+            let slices: Vec<&[f64]> = columns.iter().map(|column| &column[start..start + len]).collect();
+            engine.run_chunk(program, &slices, len, &mut state, &mut out);
+        }
+        out
+    }
+
+    /// Same rows, and the same trigger and output bits.
+    fn assert_same(expected: &Emissions, actual: &Emissions, what: &str) {
+        let bits = |values: &[f64]| values.iter().map(|v| v.to_bits()).collect::<Vec<_>>();
+        assert_eq!(expected.rows, actual.rows, "{}: rows", what);
+        assert_eq!(bits(&expected.triggers), bits(&actual.triggers), "{}: triggers", what);
+        for (i, (e, a)) in expected.outputs.iter().zip(&actual.outputs).enumerate() {
+            assert_eq!(bits(e), bits(a), "{}: output {}", what, i);
+        }
+    }
+
+    #[test]
+    fn every_engine_matches_sweep() {
+        let program = graph();
+        let columns = columns(2 * PARALLEL_ROWS + 123);
+        let expected = run("sweep", &program, &columns, usize::MAX);
+        assert!(expected.len() > 1000);
+        for name in names() {
+            assert_same(&expected, &run(name, &program, &columns, usize::MAX), name);
+        }
+    }
+
+    #[test]
+    fn every_engine_matches_sweep_streamed() {
+        let program = graph();
+        let columns = columns(PARALLEL_ROWS + 2 * BLOCK_ROWS + 7);
+        let expected = run("sweep", &program, &columns, usize::MAX);
+        for name in names() {
+            for chunk in [1, 7, BLOCK_ROWS - 1, BLOCK_ROWS + 1, PARALLEL_ROWS + 5] {
+                assert_same(&expected, &run(name, &program, &columns, chunk), &format!("{} in chunks of {}", name, chunk));
+            }
+        }
+    }
+
+    #[test]
+    fn nan_triggers_always_emit_and_signed_zeros_do_not() {
+        let nodes = vec![input("x"), input("y"), Node::Div { left: 0, right: 1 }];
+        let program = Program::new(nodes, 2, named(&[0]), Vec::new(), None, false).unwrap();
+        let columns = vec![
+            vec![1.0, 1.0, 0.0, -0.0, 0.0, 2.0, 2.0, 0.0],
+            vec![1.0, 0.0, 0.0, 1.0, 1.0, 1.0, 1.0, -1.0],
+        ];
+        // x / 0 is NaN, which never equals the last trigger; 0 == -0
+        let expected = run("sweep", &program, &columns, usize::MAX);
+        assert_eq!(expected.rows, vec![0, 1, 2, 3, 5, 7]);
+        assert_eq!(expected.outputs[0][3].to_bits(), (-0.0f64).to_bits());
+        for name in names() {
+            for chunk in [1, 3, usize::MAX] {
+                assert_same(&expected, &run(name, &program, &columns, chunk), name);
+            }
+        }
+    }
+
+    #[test]
+    fn blocks_shrink_for_large_graphs() {
+        // A sum of many products: more nodes than a full block fits
+        let mut nodes = vec![input("a"), input("b")];
+        for i in 0..3000 {
+            nodes.push(Node::Const { value: i as f64 });
+            nodes.push(Node::Mul { children: vec![i % 2, nodes.len() - 1] });
+        }
+        let terms: Vec<NodeId> = (0..3000).map(|i| 3 + 2 * i).collect();
+        nodes.push(Node::Add { children: terms });
+        let root = nodes.len() - 1;
+        let program = Program::new(nodes, root, named(&[5, root - 1]), Vec::new(), None, false).unwrap();
+        assert!(Block::rows_for(&program.plan) < BLOCK_ROWS);
+
+        let choices = [0.0, 1.0, 2.0];
+        let columns = vec![column(500, 4, &choices), column(500, 5, &choices)];
+        let expected = run("sweep", &program, &columns, usize::MAX);
+        for name in names() {
+            assert_same(&expected, &run(name, &program, &columns, 37), name);
+        }
+    }
+
+    #[test]
+    fn partitions_run_as_if_alone() {
+        let program = graph();
+        let columns = columns(3000);
+        let keys = column(3000, 6, &[7.0, 9.0, 11.0]).into_iter().map(|k| k as i64).collect::<Vec<_>>();
+        let slices: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+
+        let (emissions, emitted_keys) = run_partitioned(&program, &BlockEngine, &slices, &keys);
+        for key in [7, 9, 11] {
+            let rows: Vec<usize> = (0..keys.len()).filter(|&r| keys[r] == key).collect();
+            let alone: Vec<Vec<f64>> = columns.iter().map(|c| rows.iter().map(|&r| c[r]).collect()).collect();
+            let mut expected = run("sweep", &program, &alone, usize::MAX);
+            for row in &mut expected.rows {
+                *row = rows[*row];
+            }
+            let mut actual = Emissions::new(program.outputs.len());
+            for e in (0..emissions.len()).filter(|&e| emitted_keys[e] == key) {
+                actual.push(emissions.rows[e], emissions.triggers[e], emissions.outputs.iter().map(|column| column[e]));
+            }
+            assert_same(&expected, &actual, &format!("key {}", key));
+        }
+    }
+
+    #[test]
+    fn level_engine_splits_wide_levels() {
+        // One level of products wider than PARALLEL_WIDTH, summed into the
+        // trigger in chunks so the next level is wide too
+        let mut nodes = vec![input("a"), input("b"), input("c"), input("d")];
+        for i in 0..PARALLEL_WIDTH + 500 {
+            nodes.push(Node::Const { value: 1.0 + i as f64 / 8.0 });
+        }
+        let products: Vec<NodeId> = (0..PARALLEL_WIDTH + 500)
+            .map(|i| {
+                nodes.push(Node::Mul { children: vec![i % 4, 4 + i] });
+                nodes.len() - 1
+            })
+            .collect();
+        let sums: Vec<NodeId> = products.chunks(8)
+            .map(|chunk| {
+                nodes.push(Node::Add { children: chunk.to_vec() });
+                nodes.len() - 1
+            })
+            .collect();
+        nodes.push(Node::Add { children: sums.clone() });
+        let root = nodes.len() - 1;
+        let program = Program::new(nodes, root, named(&[sums[0], products[17]]), Vec::new(), None, false).unwrap();
+
+        let engine = LevelEngine::new(&program);
+        assert!(engine.levels.iter().any(|&(start, end)| end - start >= PARALLEL_WIDTH));
+
+        let choices = [0.0, -0.0, 1.0, 3.0];
+        let columns: Vec<Vec<f64>> = (0..4).map(|seed| column(300, seed, &choices)).collect();
+        let expected = run("sweep", &program, &columns, usize::MAX);
+        assert!(expected.len() > 10);
+        assert_same(&expected, &run("level", &program, &columns, usize::MAX), "level");
+        assert_same(&expected, &run("level", &program, &columns, 7), "level in chunks");
+    }
+
+    #[test]
+    fn parameter_sweep_matches_replaced_constants() {
+        let build = |value: f64| {
+            let nodes = vec![
+                input("a"),
+                input("b"),
+                Node::Const { value },
+                Node::Mul { children: vec![0, 2] },
+                Node::Add { children: vec![3, 1] },
+                Node::Add { children: vec![0, 1] },
+            ];
+            (nodes, 4, named(&[5, 3]))
+        };
+        let (nodes, root, outputs) = build(1.0);
+        let program = Program::new(nodes, root, outputs, vec![("k".to_string(), 2)], None, true).unwrap();
+        let sweep = ParamSweep::new(&program).unwrap();
+        let columns = columns(3000);
+        let slices: Vec<&[f64]> = columns.iter().take(2).map(Vec::as_slice).collect();
+
+        let values = [0.0, -0.0, 0.5, 3.0, f64::NAN];
+        let sets: Vec<Vec<f64>> = (0..2500).map(|k| vec![values[k % values.len()]]).collect();
+        let results = sweep.run(&sets, &slices, 3000);
+        assert_eq!(results.len(), sets.len());
+        for (set, actual) in sets.iter().zip(&results).take(values.len()) {
+            let (nodes, root, outputs) = build(set[0]);
+            let replaced = Program::new(nodes, root, outputs, Vec::new(), None, false).unwrap();
+            let expected = run("sweep", &replaced, &columns[..2], usize::MAX);
+            assert_same(&expected, actual, &format!("k = {}", set[0]));
+        }
+        for (k, actual) in results.iter().enumerate().skip(values.len()) {
+            assert_same(&results[k % values.len()], actual, &format!("set {}", k));
+        }
+    }
+
+    #[test]
+    fn group_members_match_running_alone() {
+        // Both read a and b and share a + b, written b + a in the second
+        let x = vec![
+            input("a"),                                   // 0
+            input("b"),                                   // 1
+            Node::Add { children: vec![0, 1] },           // 2
+            input("c"),                                   // 3
+            Node::Div { left: 2, right: 3 },              // 4: trigger
+        ];
+        let y = vec![
+            input("b"),                                   // 0
+            input("a"),                                   // 1
+            Node::Add { children: vec![0, 1] },           // 2
+            Node::Mul { children: vec![2, 2] },           // 3
+            Node::Div { left: 3, right: 0 },              // 4: trigger
+        ];
+        let roles = [(4, vec![2]), (4, vec![2, 3])];
+        let (merged, maps) = crate::optimize::merge(&[x.clone(), y.clone()]);
+        assert_eq!(merged.len(), 7);
+
+        let mut outputs = Vec::new();
+        let mut members = Vec::new();
+        for (k, ((root, member_outputs), map)) in roles.iter().zip(&maps).enumerate() {
+            let trigger = outputs.len();
+            outputs.push((format!("{}/trigger", k), map[*root]));
+            let first = outputs.len();
+            outputs.extend(member_outputs.iter().map(|&id| (format!("{}/{}", k, id), map[id])));
+            members.push(Member { trigger, outputs: first..outputs.len() });
+        }
+        let schema = || Some(vec!["a".to_string(), "b".to_string(), "c".to_string()]);
+        let root = outputs[0].1;
+        let program = Program::new(merged, root, outputs, Vec::new(), schema(), false).unwrap();
+
+        let columns = columns(3000);
+        let slices: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+        let mut prev_triggers = vec![None; members.len()];
+        let results = run_group(&program, &members, &slices, 3000, &mut prev_triggers);
+        for (k, ((nodes, (root, member_outputs)), actual)) in [x, y].into_iter().zip(&roles).zip(&results).enumerate() {
+            let alone = Program::new(nodes, *root, named(member_outputs), Vec::new(), schema(), false).unwrap();
+            let expected = run("sweep", &alone, &columns, usize::MAX);
+            assert!(expected.len() > 10);
+            assert_same(&expected, actual, &format!("member {}", k));
+        }
+    }
+}
@@ -1,7 +1,22 @@
 use pyo3::prelude::*;
-use pyo3::types::{PyDict, IntoPyDict};
+use pyo3::AsPyPointer;
+use pyo3::buffer::PyBuffer;
+use pyo3::types::{IntoPyDict, PyDict, PyList};
+use numpy::IntoPyArray;
+use once_cell::sync::OnceCell;
 use serde::{Serialize, Deserialize};
 use std::collections::HashMap;
+use std::path::PathBuf;
+use std::sync::Arc;
+
+mod binary;
+mod cache;
+mod engine;
+mod optimize;
+mod plan;
+mod stats;
+
+use engine::{Emissions, Engine, Program, RunState};
 
 // ===========================================================================
 // TYPES
@@ -20,31 +35,116 @@ pub enum Node {
     Div { left: NodeId, right: NodeId },
 }
 
-// The graph structure
+impl Node {
+    /// The serialized `type` tag.
+    pub fn type_name(&self) -> &'static str {
+        match self {
+            Node::Input { .. } => "input",
+            Node::Const { .. } => "const",
+            Node::Add { .. } => "add",
+            Node::Mul { .. } => "mul",
+            Node::Div { .. } => "div",
+        }
+    }
+}
+
+// The graph structure. `root` is the trigger; `outputs` optionally records
+// named output nodes so a Sampler can be built without passing indices, and
+// `params` the constant nodes marked as named parameters.
 #[derive(Serialize, Deserialize)]
 pub struct GraphData {
     nodes: Vec<Node>,
     root: NodeId,
+    #[serde(default, skip_serializing_if = "Vec::is_empty")]
+    outputs: Vec<NamedOutput>,
+    #[serde(default, skip_serializing_if = "Vec::is_empty")]
+    params: Vec<NamedOutput>,
+}
+
+#[derive(Clone, Serialize, Deserialize)]
+pub struct NamedOutput {
+    name: String,
+    node: NodeId,
+}
+
+// The fields of GraphData after `nodes`, written by `Graph.freeze` after the
+// node list it serializes incrementally.
+#[derive(Serialize)]
+struct GraphRoles<'a> {
+    root: NodeId,
+    #[serde(skip_serializing_if = "<[_]>::is_empty")]
+    outputs: &'a [NamedOutput],
+    #[serde(skip_serializing_if = "<[_]>::is_empty")]
+    params: &'a [NamedOutput],
 }
 
 // ===========================================================================
-// PYTHON INTERFACE - Using a single generic node class
+// PYTHON INTERFACE - A typed arena with small node handles
 // ===========================================================================
 
+/// Handle to a node in a Graph's arena.
 #[pyclass]
 #[derive(Clone)]
 pub struct PyNode {
+    graph: Py<Graph>,
     #[pyo3(get)]
-    pub id: String,
-    #[pyo3(get)]
-    pub node_type: String,
-    pub data: Py<PyAny>,  // Stores the actual data as a Python dict
+    pub index: NodeId,
 }
 
+#[pymethods]
+impl PyNode {
+    #[getter]
+    fn id(&self) -> String {
+        format!("n{}", self.index)
+    }
+    
+    #[getter]
+    fn node_type(&self, py: Python) -> &'static str {
+        self.graph.borrow(py).nodes[self.index].type_name()
+    }
+}
+
+/// Structural identity of a node: its type, operands and constant.
+/// Operands of the commutative add/mul are kept sorted.
+#[derive(PartialEq, Eq, Hash)]
+enum NodeKey {
+    Input(String),
+    Const(u64),
+    Param(String),
+    Add(Vec<NodeId>),
+    Mul(Vec<NodeId>),
+    Div(NodeId, NodeId),
+}
+
+impl NodeKey {
+    /// The key `node` is hash-consed on, by the builder and by
+    /// `optimize::merge`. Parameters are keyed by name instead.
+    fn of(node: &Node) -> Self {
+        let sorted = |children: &[NodeId]| {
+            let mut sorted = children.to_vec();
+            sorted.sort_unstable();
+            sorted
+        };
+        match node {
+            Node::Input { name } => NodeKey::Input(name.clone()),
+            Node::Const { value } => NodeKey::Const(value.to_bits()),
+            Node::Add { children } => NodeKey::Add(sorted(children)),
+            Node::Mul { children } => NodeKey::Mul(sorted(children)),
+            Node::Div { left, right } => NodeKey::Div(*left, *right),
+        }
+    }
+}
+
+/// Graph builder. Nodes live in an append-only typed arena; since a node can
+/// only refer to nodes built before it, the arena is always in dependency
+/// order.
 #[pyclass]
 pub struct Graph {
-    next_id: NodeId,
-    registry: HashMap<String, PyNode>,
+    nodes: Vec<Node>,
+    interned: HashMap<NodeKey, NodeId>,  // hash-consing: identical nodes are built once
+    frozen: String,                      // YAML list items of nodes[..frozen_len]
+    frozen_len: usize,
+    params: Vec<NamedOutput>,            // constants marked as parameters, in creation order
 }
 
 #[pymethods]
@@ -52,210 +152,922 @@ impl Graph {
     #[new]
     fn new() -> Self {
         Self {
-            next_id: 0,
-            registry: HashMap::new(),
+            nodes: Vec::new(),
+            interned: HashMap::new(),
+            frozen: String::new(),
+            frozen_len: 0,
+            params: Vec::new(),
+        }
+    }
+    
+    /// Number of distinct nodes built so far.
+    fn __len__(&self) -> usize {
+        self.nodes.len()
+    }
+    
+    fn input(mut slf: PyRefMut<'_, Self>, name: String) -> PyNode {
+        let index = slf.intern(Node::Input { name });
+        handle(slf, index)
+    }
+    
+    fn r#const(mut slf: PyRefMut<'_, Self>, value: f64) -> PyNode {
+        let index = slf.intern(Node::Const { value });
+        handle(slf, index)
+    }
+    
+    /// A constant marked as the named parameter `name`, whose value
+    /// `Sampler.sweep` can override. A parameter is never folded into or
+    /// shared with other constants; asking for an existing name again returns
+    /// its node.
+    fn param(mut slf: PyRefMut<'_, Self>, name: String, value: f64) -> PyResult<PyNode> {
+        let count = slf.nodes.len();
+        let index = slf.intern_as(NodeKey::Param(name.clone()), Node::Const { value });
+        if index == count {
+            slf.params.push(NamedOutput { name, node: index });
+        } else if !matches!(slf.nodes[index], Node::Const { value: v } if v.to_bits() == value.to_bits()) {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                format!("Parameter {} already exists with a different value", name)
+            ));
         }
+        Ok(handle(slf, index))
     }
     
-    fn input(&mut self, py: Python, name: String) -> PyNode {
-        self.create_node(py, "input", [("name", name.to_object(py))].into_py_dict(py))
+    fn add(mut slf: PyRefMut<'_, Self>, children: Vec<PyNode>) -> PyResult<PyNode> {
+        let children = indices(&slf, &children)?;
+        let index = slf.associative(true, children);
+        Ok(handle(slf, index))
     }
     
-    fn r#const(&mut self, py: Python, value: f64) -> PyNode {
-        self.create_node(py, "const", [("value", value.to_object(py))].into_py_dict(py))
+    fn mul(mut slf: PyRefMut<'_, Self>, children: Vec<PyNode>) -> PyResult<PyNode> {
+        let children = indices(&slf, &children)?;
+        let index = slf.associative(false, children);
+        Ok(handle(slf, index))
     }
     
-    fn add(&mut self, py: Python, children: Vec<PyObject>) -> PyNode {
-        self.create_node(py, "add", [("children", children.to_object(py))].into_py_dict(py))
+    fn div(mut slf: PyRefMut<'_, Self>, left: PyNode, right: PyNode) -> PyResult<PyNode> {
+        let (left, right) = (indices(&slf, &[left])?[0], indices(&slf, &[right])?[0]);
+        let index = slf.intern(Node::Div { left, right });
+        Ok(handle(slf, index))
     }
     
-    fn mul(&mut self, py: Python, children: Vec<PyObject>) -> PyNode {
-        self.create_node(py, "mul", [("children", children.to_object(py))].into_py_dict(py))
+    // Bulk builders: one call creates many nodes of one type from arrays and
+    // returns their indices as an int64 NumPy array, skipping the per-node
+    // Python objects. Index arrays may be NumPy integer arrays or sequences;
+    // `node(i)` turns an index back into a handle.
+    
+    /// Handle to the node at `index`.
+    fn node(slf: PyRef<'_, Self>, index: NodeId) -> PyResult<PyNode> {
+        check_indices(&slf.nodes, &[index])?;
+        Ok(handle(slf, index))
     }
     
-    fn div(&mut self, py: Python, left: PyObject, right: PyObject) -> PyNode {
-        let data = [("left", left), ("right", right)].into_py_dict(py);
-        self.create_node(py, "div", data)
+    /// One `input` node per name.
+    fn inputs(&mut self, py: Python, names: Vec<String>) -> PyObject {
+        let ids: Vec<i64> = names.into_iter()
+            .map(|name| self.intern(Node::Input { name }) as i64)
+            .collect();
+        ids.into_pyarray(py).to_object(py)
     }
     
-    fn create_node(&mut self, _py: Python, node_type: &str, data: &PyDict) -> PyNode {
-        let id = format!("n{}", self.next_id);
-        self.next_id += 1;
-        
-        let node = PyNode {
-            id: id.clone(),
-            node_type: node_type.to_string(),
-            data: data.into(),
+    /// One `const` node per value of a float array.
+    fn consts(&mut self, py: Python, values: &PyAny) -> PyResult<PyObject> {
+        let values: Vec<f64> = match PyBuffer::<f64>::get(values) {
+            Ok(buffer) => buffer.to_vec(py)?,
+            Err(_) => values.extract()?,
         };
-        
-        self.registry.insert(id, node.clone());
-        node
+        let ids: Vec<i64> = values.into_iter()
+            .map(|value| self.intern(Node::Const { value }) as i64)
+            .collect();
+        Ok(ids.into_pyarray(py).to_object(py))
     }
     
-    fn freeze(&self, py: Python, root: PyNode) -> PyResult<String> {
-        // Collect all nodes via traversal
-        let mut seen = Vec::new();
-        let root_id = root.id.clone();
-        let mut stack = vec![root];
+    /// One `add` node per CSR row: node i sums
+    /// `children[offsets[i]:offsets[i + 1]]`.
+    fn add_many(&mut self, py: Python, offsets: &PyAny, children: &PyAny) -> PyResult<PyObject> {
+        self.associative_many(py, true, offsets, children)
+    }
+    
+    /// One `mul` node per CSR row, as for `add_many`.
+    fn mul_many(&mut self, py: Python, offsets: &PyAny, children: &PyAny) -> PyResult<PyObject> {
+        self.associative_many(py, false, offsets, children)
+    }
+    
+    /// One `div` node per `(left[i], right[i])` pair.
+    fn div_many(&mut self, py: Python, left: &PyAny, right: &PyAny) -> PyResult<PyObject> {
+        let (left, right) = (index_array(py, left)?, index_array(py, right)?);
+        if left.len() != right.len() {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                format!("left has {} indices but right has {}", left.len(), right.len())
+            ));
+        }
+        check_indices(&self.nodes, &left)?;
+        check_indices(&self.nodes, &right)?;
+        let ids: Vec<i64> = left.into_iter()
+            .zip(right)
+            .map(|(left, right)| self.intern(Node::Div { left, right }) as i64)
+            .collect();
+        Ok(ids.into_pyarray(py).to_object(py))
+    }
+    
+    /// Serialize the graph with `root` as the trigger and the named `outputs`
+    /// to YAML, recording the output roles so `Sampler(yaml)` needs no indices,
+    /// and every parameter built with `param`.
+    ///
+    /// The whole arena is written, in dependency order and with node indices
+    /// unchanged, so indices stay valid from one freeze to the next; Samplers
+    /// prune what the trigger and outputs do not use. Nodes serialized by an
+    /// earlier freeze are reused, so re-freezing after adding k nodes only
+    /// serializes those k.
+    #[pyo3(signature = (root, outputs = None))]
+    fn freeze(mut slf: PyRefMut<'_, Self>, root: PyNode, outputs: Option<&PyDict>) -> PyResult<String> {
+        let (names, handles): (Vec<String>, Vec<PyNode>) = match outputs {
+            Some(outputs) => named_nodes(outputs)?.into_iter().unzip(),
+            None => (Vec::new(), Vec::new()),
+        };
+        let root = indices(&slf, &[root])?[0];
+        let outputs: Vec<NamedOutput> = names.into_iter()
+            .zip(indices(&slf, &handles)?)
+            .map(|(name, node)| NamedOutput { name, node })
+            .collect();
         
-        while let Some(node) = stack.pop() {
-            if seen.iter().any(|n: &PyNode| n.id == node.id) {
-                continue;
-            }
-            
-            // Add children to stack based on node type
-            let data: &PyDict = node.data.as_ref(py).downcast()?;
-            match node.node_type.as_str() {
-                "add" | "mul" => {
-                    if let Some(children) = data.get_item("children") {
-                        let children: Vec<PyNode> = children.extract()?;
-                        stack.extend(children);
-                    }
-                }
-                "div" => {
-                    if let Some(left) = data.get_item("left") {
-                        stack.push(left.extract()?);
-                    }
-                    if let Some(right) = data.get_item("right") {
-                        stack.push(right.extract()?);
-                    }
-                }
-                _ => {}
-            }
-            
-            seen.push(node);
+        let graph = &mut *slf;
+        for node in &graph.nodes[graph.frozen_len..] {
+            graph.frozen.push_str(&to_yaml(&[node])?);
         }
+        graph.frozen_len = graph.nodes.len();
+        let roles = to_yaml(&GraphRoles { root, outputs: &outputs, params: &graph.params })?;
+        Ok(format!("nodes:\n{}{}", graph.frozen, roles))
+    }
+    
+    /// Build a Sampler for `trigger` and the named `outputs` directly, without
+    /// going through YAML. `engine`, `inputs` and `simplify` are as for
+    /// `Sampler`.
+    #[pyo3(signature = (trigger, outputs, engine = None, inputs = None, simplify = false))]
+    fn compile(slf: PyRef<'_, Self>, trigger: PyNode, outputs: &PyDict, engine: Option<&str>, inputs: Option<Vec<String>>, simplify: bool) -> PyResult<Sampler> {
+        let graph = Self::frozen(&slf, trigger, named_nodes(outputs)?)?;
+        Sampler::build(graph, None, engine, inputs, simplify)
+    }
+    
+    /// Shape and cost statistics: node counts by type, depth, width per
+    /// level, fan-in and fan-out histograms, input and output cone sizes and
+    /// an estimated cost per row (see `sdag.Sampler.stats`). With `outputs`
+    /// (name -> node), only the nodes they depend on are counted and their
+    /// cones are reported; otherwise the whole arena is counted and no
+    /// output cones are reported.
+    #[pyo3(signature = (outputs = None))]
+    fn stats(slf: PyRef<'_, Self>, py: Python, outputs: Option<&PyDict>) -> PyResult<PyObject> {
+        let stats = match outputs {
+            Some(outputs) => {
+                let (names, handles): (Vec<String>, Vec<PyNode>) = named_nodes(outputs)?.into_iter().unzip();
+                let roots = indices(&slf, &handles)?;
+                let (nodes, map) = optimize::prune(&slf.nodes, &roots)
+                    .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+                let outputs: Vec<(String, NodeId)> = names.into_iter().zip(roots.iter().map(|&id| map[id])).collect();
+                stats::compute(&nodes, &outputs)
+            }
+            None => stats::compute(&slf.nodes, &[]),
+        };
+        stats_to_python(py, &stats)
+    }
+}
+
+impl Graph {
+    /// The pruned arena for a trigger, its named outputs and the parameters.
+    fn frozen(slf: &PyRef<'_, Self>, root: PyNode, outputs: Vec<(String, PyNode)>) -> PyResult<GraphData> {
+        let root = indices(slf, &[root])?[0];
+        let (names, handles): (Vec<String>, Vec<PyNode>) = outputs.into_iter().unzip();
+        let output_ids = indices(slf, &handles)?;
         
-        // Build serialized graph
-        seen.reverse();
-        let mut id_map: HashMap<String, NodeId> = HashMap::new();
-        let mut nodes = Vec::new();
-        let root_idx = seen.iter().position(|n| n.id == root_id).unwrap();
+        let roots: Vec<NodeId> = std::iter::once(root)
+            .chain(output_ids.iter().copied())
+            .chain(slf.params.iter().map(|p| p.node))
+            .collect();
+        let (nodes, map) = optimize::prune(&slf.nodes, &roots)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
         
-        for (idx, py_node) in seen.iter().enumerate() {
-            id_map.insert(py_node.id.clone(), idx);
-            
-            let data: &PyDict = py_node.data.as_ref(py).downcast()?;
-            let node = match py_node.node_type.as_str() {
-                "input" => {
-                    let name: String = data.get_item("name").unwrap().extract()?;
-                    Node::Input { name }
-                }
-                "const" => {
-                    let value: f64 = data.get_item("value").unwrap().extract()?;
-                    Node::Const { value }
-                }
-                "add" => {
-                    let children: Vec<PyNode> = data.get_item("children").unwrap().extract()?;
-                    let children = children.iter()
-                        .map(|c| id_map[&c.id])
-                        .collect();
-                    Node::Add { children }
-                }
-                "mul" => {
-                    let children: Vec<PyNode> = data.get_item("children").unwrap().extract()?;
-                    let children = children.iter()
-                        .map(|c| id_map[&c.id])
-                        .collect();
-                    Node::Mul { children }
-                }
-                "div" => {
-                    let left: PyNode = data.get_item("left").unwrap().extract()?;
-                    let right: PyNode = data.get_item("right").unwrap().extract()?;
-                    Node::Div {
-                        left: id_map[&left.id],
-                        right: id_map[&right.id],
-                    }
-                }
-                _ => return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
-                    format!("Unknown node type: {}", py_node.node_type)
-                )),
-            };
-            
-            nodes.push(node);
+        let outputs = names.into_iter()
+            .zip(output_ids)
+            .map(|(name, id)| NamedOutput { name, node: map[id] })
+            .collect();
+        let params = slf.params.iter()
+            .map(|p| NamedOutput { name: p.name.clone(), node: map[p.node] })
+            .collect();
+        Ok(GraphData { nodes, root: map[root], outputs, params })
+    }
+    
+    /// Build (or find) an `add` (`is_add`) or `mul` over `children`.
+    fn associative(&mut self, is_add: bool, children: Vec<NodeId>) -> NodeId {
+        if is_add {
+            self.intern(Node::Add { children })
+        } else {
+            self.intern(Node::Mul { children })
         }
-        
-        let graph = GraphData { nodes, root: root_idx };
-        serde_yaml::to_string(&graph)
-            .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))
     }
+    
+    fn associative_many(&mut self, py: Python, is_add: bool, offsets: &PyAny, children: &PyAny) -> PyResult<PyObject> {
+        let (offsets, children) = (index_array(py, offsets)?, index_array(py, children)?);
+        if let Some(i) = (1..offsets.len()).find(|&i| offsets[i] < offsets[i - 1] || offsets[i] > children.len()) {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                format!("offsets[{}] = {} is out of order or past the end of children", i, offsets[i])
+            ));
+        }
+        check_indices(&self.nodes, &children)?;
+        let ids: Vec<i64> = offsets.windows(2)
+            .map(|range| self.associative(is_add, children[range[0]..range[1]].to_vec()) as i64)
+            .collect();
+        Ok(ids.into_pyarray(py).to_object(py))
+    }
+    
+    /// Return the index of the node already built like `node`, or append it.
+    fn intern(&mut self, node: Node) -> NodeId {
+        self.intern_as(NodeKey::of(&node), node)
+    }
+    
+    /// Return the index of the node already built for `key`, or append `node`.
+    fn intern_as(&mut self, key: NodeKey, node: Node) -> NodeId {
+        if let Some(&index) = self.interned.get(&key) {
+            return index;
+        }
+        self.nodes.push(node);
+        self.interned.insert(key, self.nodes.len() - 1);
+        self.nodes.len() - 1
+    }
+}
+
+/// A handle to node `index` of the graph behind `slf`.
+fn handle<T: Into<Py<Graph>>>(slf: T, index: NodeId) -> PyNode {
+    PyNode { graph: slf.into(), index }
+}
+
+fn to_yaml<T: Serialize + ?Sized>(value: &T) -> PyResult<String> {
+    serde_yaml::to_string(value)
+        .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))
+}
+
+/// Read a 1-D array of node indices: an int64 buffer, or any sequence of
+/// non-negative ints.
+fn index_array(py: Python, array: &PyAny) -> PyResult<Vec<NodeId>> {
+    let values: Vec<i64> = match PyBuffer::<i64>::get(array) {
+        Ok(buffer) => buffer.to_vec(py)?,
+        Err(_) => array.extract()?,
+    };
+    values.into_iter()
+        .map(|value| NodeId::try_from(value).map_err(|_| PyErr::new::<pyo3::exceptions::PyValueError, _>(
+            format!("Node index {} is negative", value)
+        )))
+        .collect()
+}
+
+/// Check that every index refers to an existing node.
+fn check_indices(nodes: &[Node], indices: &[NodeId]) -> PyResult<()> {
+    match indices.iter().find(|&&id| id >= nodes.len()) {
+        Some(id) => Err(PyErr::new::<pyo3::exceptions::PyIndexError, _>(
+            format!("Node index {} is out of range for a graph of {} nodes", id, nodes.len())
+        )),
+        None => Ok(()),
+    }
+}
+
+/// (name, node) pairs of a name -> node dict, in insertion order.
+fn named_nodes(outputs: &PyDict) -> PyResult<Vec<(String, PyNode)>> {
+    outputs.iter()
+        .map(|(name, node)| Ok((name.extract()?, node.extract()?)))
+        .collect()
+}
+
+/// Arena indices of `nodes`, which must all belong to `graph`.
+fn indices(graph: &impl AsPyPointer, nodes: &[PyNode]) -> PyResult<Vec<NodeId>> {
+    nodes.iter()
+        .map(|node| {
+            if node.graph.as_ptr() == graph.as_ptr() {
+                Ok(node.index)
+            } else {
+                Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                    format!("Node {} belongs to a different Graph", node.index)
+                ))
+            }
+        })
+        .collect()
 }
 
 // ===========================================================================
 // EVALUATION
 // ===========================================================================
 
+/// Samplers are immutable once built and engines keep their scratch space
+/// per call, so one Sampler can be run from several Python threads at once.
+/// The GIL is released while the engine runs.
 #[pyclass]
 pub struct Sampler {
-    nodes: Vec<Node>,
-    root: NodeId,
-    outputs: Vec<NodeId>,
+    program: Arc<Program>,
+    engine: Arc<dyn Engine>,
+    /// Parameter split for `sweep`, built on first use; shared by the
+    /// `with_engine` copies, which run the same program
+    sweep: Arc<OnceCell<engine::ParamSweep>>,
 }
 
 #[pymethods]
 impl Sampler {
+    /// `outputs` lists output node indices, reported as "output{i}"; when
+    /// omitted, the named outputs recorded by `Graph.freeze` are used.
+    /// `engine` selects the evaluation strategy by name; see `sdag.engines()`.
+    /// `inputs` fixes the column order used for positional rows; by default
+    /// it is the order in which Input nodes first appear in the graph.
+    /// `simplify=True` folds constants and simplifies the arithmetic before
+    /// compiling; regrouped sums and products may then differ in the last
+    /// bits, so it is off by default.
+    ///
+    /// Compiled graphs are cached process-wide, so building a Sampler again
+    /// from the same YAML and options reuses the compiled plan; see
+    /// `sdag.cache_info()`.
     #[new]
-    fn new(yaml: &str, outputs: Vec<NodeId>, _engine: Option<&str>) -> PyResult<Self> {
-        let graph: GraphData = serde_yaml::from_str(yaml)
-            .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?;
+    #[pyo3(signature = (yaml, outputs = None, engine = None, inputs = None, simplify = false))]
+    fn new(yaml: &str, outputs: Option<Vec<NodeId>>, engine: Option<&str>, inputs: Option<Vec<String>>, simplify: bool) -> PyResult<Self> {
+        let key = cache::Key::new(yaml, outputs.as_deref(), inputs.as_deref(), simplify);
+        let cached = cache::CACHE.lock().unwrap().get(&key);
+        let program = match cached {
+            Some(program) => program,
+            None => {
+                let graph: GraphData = serde_yaml::from_str(yaml)
+                    .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?;
+                let program = Arc::new(Self::program(graph, outputs, inputs, simplify)?);
+                cache::CACHE.lock().unwrap().insert(key, Arc::clone(&program));
+                program
+            }
+        };
+        Self::with_program(program, engine.unwrap_or(engine::DEFAULT_ENGINE))
+    }
+    
+    /// Open a graph written by `save`. The file is memory-mapped rather than
+    /// parsed, so opening is cheap and processes share one copy of the plan.
+    /// `engine` defaults to "tape", which evaluates straight from the mapping.
+    #[staticmethod]
+    #[pyo3(signature = (path, engine = None))]
+    fn open(path: PathBuf, engine: Option<&str>) -> PyResult<Self> {
+        let program = binary::open(&path)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+        Self::with_program(Arc::new(program), engine.unwrap_or("tape"))
+    }
+    
+    /// Save the compiled graph in the binary format read by `open`.
+    /// Parameter names are not recorded; parameters load as constants.
+    fn save(&self, path: PathBuf) -> PyResult<()> {
+        binary::write(&self.program, &path)
+            .map_err(PyErr::new::<pyo3::exceptions::PyIOError, _>)
+    }
+    
+    /// Output names, in result order.
+    #[getter]
+    fn outputs(&self) -> Vec<String> {
+        self.program.output_names.clone()
+    }
+    
+    /// Number of nodes removed by constant folding and simplification.
+    #[getter]
+    fn simplified(&self) -> usize {
+        self.program.simplified
+    }
+    
+    /// Name of the evaluation engine in use.
+    #[getter]
+    fn engine(&self) -> &'static str {
+        self.engine.name()
+    }
+    
+    /// A Sampler over the same compiled graph using a different engine.
+    fn with_engine(&self, engine: &str) -> PyResult<Sampler> {
+        let engine = engine::create(engine, &self.program)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+        Ok(Sampler { program: Arc::clone(&self.program), engine: Arc::from(engine), sweep: Arc::clone(&self.sweep) })
+    }
+    
+    /// Input names in column-slot order, i.e. the layout of positional rows.
+    #[getter]
+    fn inputs(&self) -> Vec<String> {
+        self.program.plan.inputs.clone()
+    }
+    
+    /// Parameter names (see `Graph.param`), in sweep order.
+    #[getter]
+    fn params(&self) -> Vec<String> {
+        self.program.param_names.clone()
+    }
+    
+    /// Run over a list of rows. Each row is either a dict keyed by input name
+    /// (missing inputs read as 0.0) or a sequence of values in `inputs` order.
+    ///
+    /// Returns one dict per emitted row, or with `columnar=True` a single dict
+    /// of NumPy arrays: "row" (input row index), "trigger" and one per output.
+    #[pyo3(signature = (rows, columnar = false))]
+    fn run(&self, py: Python, rows: Vec<&PyAny>, columnar: bool) -> PyResult<PyObject> {
+        let mut state = RunState::new(&self.program);
+        let columns = columns_from_rows(&self.program, &rows)?;
+        let columns: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+        evaluate(py, &self.program, &*self.engine, &columns, rows.len(), &mut state, columnar)
+    }
+    
+    /// Run over columnar input: a mapping of input name to a 1-D float64
+    /// buffer (e.g. a NumPy array). Columns are read in place, not copied,
+    /// and must not be written to by other threads during the call.
+    /// Results are shaped as in `run`.
+    #[pyo3(signature = (columns, columnar = false))]
+    fn run_columns(&self, py: Python, columns: &PyDict, columnar: bool) -> PyResult<PyObject> {
+        let mut state = RunState::new(&self.program);
+        let buffers = column_buffers(&self.program, columns)?;
+        let (columns, n_rows) = column_slices(py, &self.program, &buffers)?;
+        evaluate(py, &self.program, &*self.engine, &columns, n_rows, &mut state, columnar)
+    }
+    
+    /// Run over an interleaved feed of independent partitions, such as the
+    /// symbols of a multi-symbol feed. `columns` is as for `run_columns` and
+    /// must also hold the integer column named `key`; each key's rows are
+    /// evaluated with their own trigger and node state, as if run alone, and
+    /// partitions run in parallel. Results are in row order and shaped as in
+    /// `run`, with each emission's "key" and its "row" index in the feed.
+    #[pyo3(signature = (columns, key, columnar = false))]
+    fn run_partitioned(&self, py: Python, columns: &PyDict, key: &str, columnar: bool) -> PyResult<PyObject> {
+        if self.program.output_names.iter().any(|name| name == "key") {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                "Output name key is reserved in partitioned results"
+            ));
+        }
+        let keys = columns.get_item(key).ok_or_else(|| PyErr::new::<pyo3::exceptions::PyKeyError, _>(
+            format!("Missing key column: {}", key)
+        ))?;
+        let keys: Vec<i64> = match PyBuffer::<i64>::get(keys) {
+            Ok(buffer) => buffer.to_vec(py)?,
+            Err(_) => keys.extract()?,
+        };
+        let buffers = column_buffers(&self.program, columns)?;
+        let (columns, n_rows) = column_slices(py, &self.program, &buffers)?;
+        if keys.len() != n_rows && !columns.is_empty() {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                format!("Key column {} has {} rows, expected {}", key, keys.len(), n_rows)
+            ));
+        }
         
-        Ok(Self {
-            nodes: graph.nodes,
-            root: graph.root,
-            outputs,
-        })
+        let (program, engine) = (&*self.program, &*self.engine);
+        let (emissions, keys) = py.allow_threads(|| engine::run_partitioned(program, engine, &columns, &keys));
+        results_to_python(py, &program.output_names, emissions, Some(keys), columnar)
     }
     
-    fn run(&self, rows: Vec<HashMap<String, f64>>) -> PyResult<Vec<HashMap<String, f64>>> {
-        let mut results = Vec::new();
-        let mut prev_trigger: Option<f64> = None;
+    /// Evaluate K parameter sets over the same columnar input in one pass.
+    /// `params` maps parameter name -> a 1-D float array of K values; set k
+    /// takes the k-th value of each, and parameters left out keep their
+    /// built value. The inputs are read once for all sets, nodes that depend
+    /// on no parameter are evaluated once per row, and the rest once per row
+    /// and set. Each set has its own trigger state. The split between the
+    /// two is worked out on the first sweep and kept for later ones.
+    ///
+    /// Returns a list of K results, each shaped as in `run`.
+    #[pyo3(signature = (columns, params, columnar = false))]
+    fn sweep(&self, py: Python, columns: &PyDict, params: &PyDict, columnar: bool) -> PyResult<PyObject> {
+        let program = &*self.program;
+        let mut values: Vec<Option<Vec<f64>>> = vec![None; program.params.len()];
+        let mut n_sets = None;
+        for (name, array) in params.iter() {
+            let name: String = name.extract()?;
+            let p = program.param_names.iter().position(|param| *param == name).ok_or_else(|| {
+                PyErr::new::<pyo3::exceptions::PyValueError, _>(format!("Unknown parameter: {}", name))
+            })?;
+            let array: Vec<f64> = match PyBuffer::<f64>::get(array) {
+                Ok(buffer) => buffer.to_vec(py)?,
+                Err(_) => array.extract()?,
+            };
+            if let Some(n) = n_sets.filter(|&n| n != array.len()) {
+                return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                    format!("Parameter {} has {} values, expected {}", name, array.len(), n)
+                ));
+            }
+            n_sets = Some(array.len());
+            values[p] = Some(array);
+        }
+        let n_sets = n_sets.ok_or_else(|| PyErr::new::<pyo3::exceptions::PyValueError, _>(
+            "sweep needs values for at least one parameter"
+        ))?;
+        let sets: Vec<Vec<f64>> = (0..n_sets)
+            .map(|k| values.iter()
+                .zip(&program.params)
+                .map(|(given, &id)| match given {
+                    Some(given) => given[k],
+                    None => program.plan.consts[program.plan.a[id] as usize],
+                })
+                .collect())
+            .collect();
         
-        for inputs in rows {
-            // Simple sweep evaluation
-            let mut values = vec![0.0; self.nodes.len()];
-            
-            for (i, node) in self.nodes.iter().enumerate() {
-                values[i] = match node {
-                    Node::Input { name } => *inputs.get(name).unwrap_or(&0.0),
-                    Node::Const { value } => *value,
-                    Node::Add { children } => children.iter().map(|&id| values[id]).sum(),
-                    Node::Mul { children } => children.iter().map(|&id| values[id]).product(),
-                    Node::Div { left, right } => {
-                        let l = values[*left];
-                        let r = values[*right];
-                        if r == 0.0 { f64::NAN } else { l / r }
-                    }
-                };
+        let buffers = column_buffers(program, columns)?;
+        let (columns, n_rows) = column_slices(py, program, &buffers)?;
+        let sweep = &*self.sweep;
+        let emissions = py.allow_threads(|| {
+            sweep.get_or_try_init(|| engine::ParamSweep::new(program))
+                .map(|sweep| sweep.run(&sets, &columns, n_rows))
+        }).map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+        let results = emissions.into_iter()
+            .map(|emissions| results_to_python(py, &program.output_names, emissions, None, columnar))
+            .collect::<PyResult<Vec<PyObject>>>()?;
+        Ok(results.to_object(py))
+    }
+    
+    /// Shape and cost statistics of the compiled graph, after pruning and
+    /// simplification, as a dict:
+    ///
+    /// - "nodes", "by_type" (type -> count)
+    /// - "depth" (longest path from an input or constant), "level_widths"
+    ///   (node count per level) and "max_width"
+    /// - "fan_in" (operand count -> nodes) and "fan_out" (use count -> nodes)
+    /// - "input_cones" (input -> nodes depending on it) and "output_cones"
+    ///   (output, and "trigger" -> nodes it depends on)
+    /// - "cost_per_row": estimated cost of one full evaluation, in units of
+    ///   about one floating point add
+    fn stats(&self, py: Python) -> PyResult<PyObject> {
+        let program = &self.program;
+        let outputs: Vec<(String, NodeId)> = std::iter::once(("trigger".to_string(), program.root))
+            .chain(program.output_names.iter().cloned().zip(program.outputs.iter().copied()))
+            .collect();
+        stats_to_python(py, &stats::compute(&program.plan.to_nodes(), &outputs))
+    }
+    
+    /// Start a streaming session that carries trigger and node state from
+    /// one chunk of rows to the next.
+    fn stream(&self) -> Stream {
+        Stream {
+            state: RunState::new(&self.program),
+            program: Arc::clone(&self.program),
+            engine: Arc::clone(&self.engine),
+        }
+    }
+}
+
+impl Sampler {
+    fn build(graph: GraphData, outputs: Option<Vec<NodeId>>, engine: Option<&str>, inputs: Option<Vec<String>>, simplify: bool) -> PyResult<Self> {
+        let program = Self::program(graph, outputs, inputs, simplify)?;
+        Self::with_program(Arc::new(program), engine.unwrap_or(engine::DEFAULT_ENGINE))
+    }
+    
+    fn program(graph: GraphData, outputs: Option<Vec<NodeId>>, inputs: Option<Vec<String>>, simplify: bool) -> PyResult<Program> {
+        let outputs = match outputs {
+            Some(ids) => ids.into_iter()
+                .enumerate()
+                .map(|(i, id)| (format!("output{}", i), id))
+                .collect(),
+            None => graph.outputs.into_iter().map(|o| (o.name, o.node)).collect(),
+        };
+        
+        let params = graph.params.into_iter().map(|p| (p.name, p.node)).collect();
+        Program::new(graph.nodes, graph.root, outputs, params, inputs, simplify)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)
+    }
+    
+    fn with_program(program: Arc<Program>, engine: &str) -> PyResult<Self> {
+        let engine = engine::create(engine, &program)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+        Ok(Self { program, engine: Arc::from(engine), sweep: Arc::new(OnceCell::new()) })
+    }
+}
+
+/// A streaming session over one Sampler's graph. Feeding a day of rows in
+/// chunks emits exactly what a single `run` over all of them would, with row
+/// indices counted from the start of the stream.
+#[pyclass]
+pub struct Stream {
+    program: Arc<Program>,
+    engine: Arc<dyn Engine>,
+    state: RunState,
+}
+
+#[pymethods]
+impl Stream {
+    /// Feed the next chunk of rows; accepts and returns the same shapes as
+    /// `Sampler.run`.
+    #[pyo3(signature = (rows, columnar = false))]
+    fn feed(&mut self, py: Python, rows: Vec<&PyAny>, columnar: bool) -> PyResult<PyObject> {
+        let columns = columns_from_rows(&self.program, &rows)?;
+        let columns: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+        evaluate(py, &self.program, &*self.engine, &columns, rows.len(), &mut self.state, columnar)
+    }
+    
+    /// Feed the next chunk as columns; see `Sampler.run_columns`.
+    #[pyo3(signature = (columns, columnar = false))]
+    fn feed_columns(&mut self, py: Python, columns: &PyDict, columnar: bool) -> PyResult<PyObject> {
+        let buffers = column_buffers(&self.program, columns)?;
+        let (columns, n_rows) = column_slices(py, &self.program, &buffers)?;
+        evaluate(py, &self.program, &*self.engine, &columns, n_rows, &mut self.state, columnar)
+    }
+    
+    /// Number of rows fed so far.
+    #[getter]
+    fn rows_seen(&self) -> usize {
+        self.state.row_offset
+    }
+    
+    /// Forget all carried state, as if the stream had just been created.
+    fn reset(&mut self) {
+        self.state = RunState::new(&self.program);
+    }
+}
+
+/// Several frozen graphs, each with its own trigger and outputs, evaluated
+/// together in one pass over the rows. The graphs are merged into a single
+/// arena in which inputs of the same name and common subexpressions are
+/// built once, then pruned, simplified and compiled as one program.
+#[pyclass]
+pub struct SamplerGroup {
+    program: Arc<Program>,
+    members: Vec<engine::Member>,
+    names: Vec<String>,
+    output_names: Vec<Vec<String>>,
+    shared: usize,
+}
+
+#[pymethods]
+impl SamplerGroup {
+    /// `graphs` maps member name -> frozen YAML with named outputs (see
+    /// `Graph.freeze`). `inputs` and `simplify` are as for `Sampler`.
+    #[new]
+    #[pyo3(signature = (graphs, inputs = None, simplify = false))]
+    fn new(graphs: &PyDict, inputs: Option<Vec<String>>, simplify: bool) -> PyResult<Self> {
+        let mut names = Vec::new();
+        let mut arenas = Vec::new();
+        let mut roles = Vec::new();
+        for (name, yaml) in graphs.iter() {
+            let name: String = name.extract()?;
+            let graph: GraphData = serde_yaml::from_str(yaml.extract()?)
+                .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(format!("{}: {}", name, e)))?;
+            let roots: Vec<NodeId> = std::iter::once(graph.root).chain(graph.outputs.iter().map(|o| o.node)).collect();
+            if let Some(&id) = roots.iter().find(|&&id| id >= graph.nodes.len()) {
+                return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                    format!("{}: node index {} is out of range for a graph of {} nodes", name, id, graph.nodes.len())
+                ));
             }
-            
-            // Trigger-based output
-            let trigger = values[self.root];
-            if prev_trigger.map_or(true, |p| p != trigger) {
-                let mut record = HashMap::new();
-                record.insert("trigger".to_string(), trigger);
-                
-                for (i, &output_id) in self.outputs.iter().enumerate() {
-                    record.insert(format!("output{}", i), values[output_id]);
-                }
-                
-                results.push(record);
-                prev_trigger = Some(trigger);
+            let (nodes, map) = optimize::prune(&graph.nodes, &roots)
+                .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(format!("{}: {}", name, e)))?;
+            let outputs: Vec<(String, NodeId)> = graph.outputs.into_iter().map(|o| (o.name, map[o.node])).collect();
+            names.push(name);
+            arenas.push(nodes);
+            roles.push((map[graph.root], outputs));
+        }
+        if names.is_empty() {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("SamplerGroup needs at least one graph"));
+        }
+        
+        let (merged, maps) = optimize::merge(&arenas);
+        let shared = arenas.iter().map(Vec::len).sum::<usize>() - merged.len();
+        
+        // Every member's trigger and outputs become outputs of one program
+        let mut outputs: Vec<(String, NodeId)> = Vec::new();
+        let mut members = Vec::new();
+        let mut output_names = Vec::new();
+        for ((name, (root, member_outputs)), map) in names.iter().zip(roles).zip(&maps) {
+            if let Some((output, _)) = member_outputs.iter().find(|(output, _)| output == "row" || output == "trigger") {
+                return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                    format!("{}: output name {} is reserved", name, output)
+                ));
             }
+            let trigger = outputs.len();
+            outputs.push((format!("{}/trigger", name), map[root]));
+            let first = outputs.len();
+            outputs.extend(member_outputs.iter().map(|(output, id)| (format!("{}/{}", name, output), map[*id])));
+            members.push(engine::Member { trigger, outputs: first..outputs.len() });
+            output_names.push(member_outputs.into_iter().map(|(output, _)| output).collect());
         }
         
-        Ok(results)
+        let root = outputs[0].1;
+        let program = Program::new(merged, root, outputs, Vec::new(), inputs, simplify)
+            .map_err(PyErr::new::<pyo3::exceptions::PyValueError, _>)?;
+        Ok(Self { program: Arc::new(program), members, names, output_names, shared })
     }
+    
+    /// Member names, in result order.
+    #[getter]
+    fn members(&self) -> Vec<String> {
+        self.names.clone()
+    }
+    
+    /// Input names in column-slot order, as for `Sampler.inputs`.
+    #[getter]
+    fn inputs(&self) -> Vec<String> {
+        self.program.plan.inputs.clone()
+    }
+    
+    /// Nodes built once instead of once per member by merging the graphs.
+    #[getter]
+    fn shared(&self) -> usize {
+        self.shared
+    }
+    
+    /// Run over a list of rows, as `Sampler.run` does for each member.
+    /// Returns a dict of member name -> that member's results.
+    #[pyo3(signature = (rows, columnar = false))]
+    fn run(&self, py: Python, rows: Vec<&PyAny>, columnar: bool) -> PyResult<PyObject> {
+        let columns = columns_from_rows(&self.program, &rows)?;
+        let columns: Vec<&[f64]> = columns.iter().map(Vec::as_slice).collect();
+        self.evaluate(py, &columns, rows.len(), columnar)
+    }
+    
+    /// Run over columnar input, as `Sampler.run_columns` does for each
+    /// member. Results are shaped as in `run`.
+    #[pyo3(signature = (columns, columnar = false))]
+    fn run_columns(&self, py: Python, columns: &PyDict, columnar: bool) -> PyResult<PyObject> {
+        let buffers = column_buffers(&self.program, columns)?;
+        let (columns, n_rows) = column_slices(py, &self.program, &buffers)?;
+        self.evaluate(py, &columns, n_rows, columnar)
+    }
+}
+
+impl SamplerGroup {
+    fn evaluate(&self, py: Python, columns: &[&[f64]], n_rows: usize, columnar: bool) -> PyResult<PyObject> {
+        let (program, members) = (&*self.program, &self.members);
+        let mut prev_triggers = vec![None; members.len()];
+        let emissions = py.allow_threads(|| engine::run_group(program, members, columns, n_rows, &mut prev_triggers));
+        
+        let result = PyDict::new(py);
+        for ((name, output_names), emissions) in self.names.iter().zip(&self.output_names).zip(emissions) {
+            result.set_item(name, results_to_python(py, output_names, emissions, None, columnar)?)?;
+        }
+        Ok(result.to_object(py))
+    }
+}
+
+/// Run one chunk with the GIL released and convert the emissions.
+fn evaluate(py: Python, program: &Program, engine: &dyn Engine, columns: &[&[f64]], n_rows: usize, state: &mut RunState, columnar: bool) -> PyResult<PyObject> {
+    let mut emissions = Emissions::new(program.outputs.len());
+    py.allow_threads(|| engine.run_chunk(program, columns, n_rows, state, &mut emissions));
+    results_to_python(py, &program.output_names, emissions, None, columnar)
+}
+
+/// Transpose Python rows into one owned column per input slot.
+fn columns_from_rows(program: &Program, rows: &[&PyAny]) -> PyResult<Vec<Vec<f64>>> {
+    let inputs = &program.plan.inputs;
+    let mut columns: Vec<Vec<f64>> = (0..inputs.len())
+        .map(|_| Vec::with_capacity(rows.len()))
+        .collect();
+    
+    for row in rows {
+        if let Ok(dict) = row.downcast::<PyDict>() {
+            for (column, name) in columns.iter_mut().zip(inputs) {
+                let value = match dict.get_item(name.as_str()) {
+                    Some(v) => v.extract()?,
+                    None => 0.0,
+                };
+                column.push(value);
+            }
+        } else {
+            let values: Vec<f64> = row.extract()?;
+            if values.len() != inputs.len() {
+                return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                    format!("Positional row has {} values, expected {}", values.len(), inputs.len())
+                ));
+            }
+            for (column, value) in columns.iter_mut().zip(values) {
+                column.push(value);
+            }
+        }
+    }
+    
+    Ok(columns)
+}
+
+/// Acquire a float64 buffer for every input slot from a name -> array mapping.
+fn column_buffers(program: &Program, columns: &PyDict) -> PyResult<Vec<PyBuffer<f64>>> {
+    program.plan.inputs.iter()
+        .map(|name| {
+            let column = columns.get_item(name.as_str()).ok_or_else(|| PyErr::new::<pyo3::exceptions::PyKeyError, _>(
+                format!("Missing input column: {}", name)
+            ))?;
+            PyBuffer::get(column)
+        })
+        .collect()
+}
+
+/// Borrow every input buffer in place and check that the lengths agree.
+/// Returns the slices and the common row count.
+fn column_slices<'a>(py: Python<'a>, program: &Program, buffers: &'a [PyBuffer<f64>]) -> PyResult<(Vec<&'a [f64]>, usize)> {
+    let inputs = &program.plan.inputs;
+    let slices = buffers.iter()
+        .zip(inputs)
+        .map(|(buffer, name)| column_slice(py, buffer, name))
+        .collect::<PyResult<Vec<_>>>()?;
+    
+    let n_rows = slices.first().map_or(0, |c| c.len());
+    if let Some((column, name)) = slices.iter().zip(inputs).find(|(c, _)| c.len() != n_rows) {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+            format!("Input column {} has {} rows, expected {}", name, column.len(), n_rows)
+        ));
+    }
+    Ok((slices, n_rows))
+}
+
+/// Convert graph statistics to a dict, as documented on `Sampler.stats`.
+fn stats_to_python(py: Python, stats: &stats::Stats) -> PyResult<PyObject> {
+    let result = PyDict::new(py);
+    result.set_item("nodes", stats.nodes)?;
+    result.set_item("by_type", stats.by_type.clone().into_py_dict(py))?;
+    result.set_item("depth", stats.depth)?;
+    result.set_item("level_widths", stats.level_widths.clone())?;
+    result.set_item("max_width", stats.level_widths.iter().copied().max().unwrap_or(0))?;
+    result.set_item("fan_in", stats.fan_in.clone().into_py_dict(py))?;
+    result.set_item("fan_out", stats.fan_out.clone().into_py_dict(py))?;
+    result.set_item("input_cones", stats.input_cones.clone().into_py_dict(py))?;
+    result.set_item("output_cones", stats.output_cones.clone().into_py_dict(py))?;
+    result.set_item("cost_per_row", stats.cost_per_row)?;
+    Ok(result.to_object(py))
+}
+
+/// Convert emissions to a dict of arrays (`columnar`) or a list of records,
+/// keying each output column by its name. With `partitions` (the partition
+/// key of each emission), records also carry "key" and "row".
+fn results_to_python(py: Python, keys: &[String], emissions: Emissions, partitions: Option<Vec<i64>>, columnar: bool) -> PyResult<PyObject> {
+    if columnar {
+        let result = PyDict::new(py);
+        if let Some(partitions) = partitions {
+            result.set_item("key", partitions.into_pyarray(py))?;
+        }
+        let rows: Vec<i64> = emissions.rows.iter().map(|&row| row as i64).collect();
+        result.set_item("row", rows.into_pyarray(py))?;
+        result.set_item("trigger", emissions.triggers.into_pyarray(py))?;
+        for (key, column) in keys.iter().zip(emissions.outputs) {
+            result.set_item(key, column.into_pyarray(py))?;
+        }
+        return Ok(result.to_object(py));
+    }
+    
+    let mut records = Vec::with_capacity(emissions.len());
+    for e in 0..emissions.len() {
+        let record = PyDict::new(py);
+        if let Some(partitions) = &partitions {
+            record.set_item("key", partitions[e])?;
+            record.set_item("row", emissions.rows[e])?;
+        }
+        record.set_item("trigger", emissions.triggers[e])?;
+        for (key, column) in keys.iter().zip(&emissions.outputs) {
+            record.set_item(key, column[e])?;
+        }
+        records.push(record);
+    }
+    Ok(PyList::new(py, records).to_object(py))
+}
+
+/// Borrow a 1-D, C-contiguous float64 buffer as a slice without copying.
+fn column_slice<'a>(py: Python<'a>, buffer: &'a PyBuffer<f64>, name: &str) -> PyResult<&'a [f64]> {
+    if buffer.dimensions() != 1 || !buffer.is_c_contiguous() {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+            format!("Input column {} must be a 1-D contiguous float64 array", name)
+        ));
+    }
+    let cells = buffer.as_slice(py).ok_or_else(|| PyErr::new::<pyo3::exceptions::PyValueError, _>(
+        format!("Input column {} is not readable in place", name)
+    ))?;
+    // SAFETY: ReadOnlyCell<f64> is repr(transparent) over f64, and the
+    // exporter keeps the memory alive for as long as `buffer` is held.
+    Ok(unsafe { std::slice::from_raw_parts(cells.as_ptr() as *const f64, cells.len()) })
 }
 
 // ===========================================================================
 // MODULE
 // ===========================================================================
 
+/// Names of the available evaluation engines.
+#[pyfunction]
+fn engines() -> Vec<&'static str> {
+    engine::names()
+}
+
+/// Statistics of the compiled-graph cache: hits, misses, size and capacity.
+#[pyfunction]
+fn cache_info(py: Python) -> PyResult<PyObject> {
+    let cache = cache::CACHE.lock().unwrap();
+    let info = PyDict::new(py);
+    info.set_item("hits", cache.hits)?;
+    info.set_item("misses", cache.misses)?;
+    info.set_item("size", cache.len())?;
+    info.set_item("capacity", cache.capacity())?;
+    Ok(info.to_object(py))
+}
+
+/// Set how many compiled graphs the cache keeps (0 disables it), evicting
+/// the least recently used ones to fit.
+#[pyfunction]
+fn set_cache_size(size: usize) {
+    cache::CACHE.lock().unwrap().set_capacity(size);
+}
+
+/// Empty the compiled-graph cache and reset its statistics.
+#[pyfunction]
+fn clear_cache() {
+    cache::CACHE.lock().unwrap().clear();
+}
+
 #[pymodule]
 fn sdag(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<Graph>()?;
     m.add_class::<Sampler>()?;
+    m.add_class::<Stream>()?;
+    m.add_class::<SamplerGroup>()?;
     m.add_class::<PyNode>()?;
+    m.add_function(wrap_pyfunction!(engines, m)?)?;
+    m.add_function(wrap_pyfunction!(cache_info, m)?)?;
+    m.add_function(wrap_pyfunction!(set_cache_size, m)?)?;
+    m.add_function(wrap_pyfunction!(clear_cache, m)?)?;
     Ok(())
 }
 
@@ -264,7 +1076,11 @@ fn sdag(_py: Python, m: &PyModule) -> PyResult<()> {
 // ===========================================================================
 // To add a new node type:
 // 1. Add variant to Node enum
-// 2. Add case to evaluation match in Sampler::run
-// 3. Add method to Graph to create it
-// 4. Add case to Graph::freeze to serialize it
-// That's it!
\ No newline at end of file
+// 2. Add an Op and its compile case to Plan::compile (plan.rs)
+// 3. Add evaluation cases to Plan::eval and to each engine (engine.rs)
+// 4. Add method to Graph to create it
+// 5. Add case to Graph::freeze to serialize it
+// That's it!
+//
+// To add a new engine, implement the Engine trait and list it in
+// engine::ENGINES.
\ No newline at end of file
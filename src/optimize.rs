@@ -0,0 +1,361 @@
+//! Graph rewrites applied to a frozen arena before it is compiled.
+
+use crate::{Node, NodeId, NodeKey};
+use std::collections::{HashMap, HashSet};
+
+/// Child indices of a node.
+pub fn children(node: &Node) -> impl Iterator<Item = NodeId> + '_ {
+    let (many, pair): (&[NodeId], [Option<NodeId>; 2]) = match node {
+        Node::Add { children } | Node::Mul { children } => (children, [None, None]),
+        Node::Div { left, right } => (&[], [Some(*left), Some(*right)]),
+        Node::Input { .. } | Node::Const { .. } => (&[], [None, None]),
+    };
+    many.iter().copied().chain(pair.into_iter().flatten())
+}
+
+/// Rewrite every child index of `node` through `map`.
+pub fn remap(node: &Node, map: &[NodeId]) -> Node {
+    match node {
+        Node::Add { children } => Node::Add { children: children.iter().map(|&c| map[c]).collect() },
+        Node::Mul { children } => Node::Mul { children: children.iter().map(|&c| map[c]).collect() },
+        Node::Div { left, right } => Node::Div { left: map[*left], right: map[*right] },
+        other => other.clone(),
+    }
+}
+
+/// Keep only the nodes that `roots` depend on, listed in post-order so that
+/// every node follows its children whatever order the arena was in. Returns
+/// the pruned arena and the old -> new index map (`usize::MAX` for dropped
+/// nodes). Fails on out-of-range children and cycles.
+pub fn prune(nodes: &[Node], roots: &[NodeId]) -> Result<(Vec<Node>, Vec<NodeId>), String> {
+    const OPEN: usize = usize::MAX - 1;
+    let mut map = vec![usize::MAX; nodes.len()];
+    let mut order: Vec<NodeId> = Vec::new();
+    // (node, children expanded?)
+    let mut stack: Vec<(NodeId, bool)> = roots.iter().rev().map(|&id| (id, false)).collect();
+
+    while let Some((id, expanded)) = stack.pop() {
+        if expanded {
+            map[id] = order.len();
+            order.push(id);
+            continue;
+        }
+        match map[id] {
+            usize::MAX => {}
+            OPEN => return Err(format!("Graph has a cycle through node {}", id)),
+            _ => continue,
+        }
+        map[id] = OPEN;
+        stack.push((id, true));
+        let first_child = stack.len();
+        for child in children(&nodes[id]) {
+            if child >= nodes.len() {
+                return Err(format!("Node {} refers to missing node {}", id, child));
+            }
+            if map[child] == usize::MAX {
+                stack.push((child, false));
+            } else if map[child] == OPEN {
+                return Err(format!("Graph has a cycle through node {}", child));
+            }
+        }
+        stack[first_child..].reverse();
+    }
+
+    let pruned = order.iter().map(|&id| remap(&nodes[id], &map)).collect();
+    Ok((pruned, map))
+}
+
+/// Merge several arenas, each in dependency order, into one. Structurally
+/// identical nodes are built once, as the Graph builder's hash-consing does,
+/// so inputs of the same name are shared and so is any subexpression
+/// common to several arenas. Returns the merged arena and each arena's
+/// old -> new index map.
+pub fn merge(arenas: &[Vec<Node>]) -> (Vec<Node>, Vec<Vec<NodeId>>) {
+    let mut merged: Vec<Node> = Vec::new();
+    let mut interned: HashMap<NodeKey, NodeId> = HashMap::new();
+    let maps = arenas.iter()
+        .map(|nodes| {
+            let mut map: Vec<NodeId> = Vec::with_capacity(nodes.len());
+            for node in nodes {
+                let node = remap(node, &map);
+                let key = NodeKey::of(&node);
+                let id = *interned.entry(key).or_insert_with(|| {
+                    merged.push(node);
+                    merged.len() - 1
+                });
+                map.push(id);
+            }
+            map
+        })
+        .collect();
+    (merged, maps)
+}
+
+/// Fold constants and simplify algebraically, over an arena in dependency
+/// order (as `prune` returns it):
+///
+/// - constant-only subtrees become a single `const`, and equal constants
+///   share one node
+/// - an `add`/`mul` child of the same kind that nothing else uses is spliced
+///   into its parent, and the parent's constant children are folded into one
+/// - adding 0 and multiplying by 1 are dropped, and one-child sums and
+///   products are replaced by the child
+/// - `div` by a constant power of two becomes `mul` by its reciprocal, which
+///   is exact; other divisors are kept, since `x * (1 / r)` often differs
+///   from `x / r` (`div` by 0 is NaN)
+///
+/// Regrouping a sum or product can change results in the last bits, as any
+/// reassociation of floating point arithmetic does.
+///
+/// `pinned` constants (parameters) are treated as opaque values: they are
+/// never folded, merged with equal constants, or turned into reciprocals.
+///
+/// Returns the new arena, in dependency order but possibly holding nodes that
+/// are no longer used (`prune` it again), and the old -> new index map.
+pub fn simplify(nodes: &[Node], roots: &[NodeId], pinned: &[NodeId]) -> (Vec<Node>, Vec<NodeId>) {
+    let mut uses = vec![0usize; nodes.len()];
+    for id in nodes.iter().flat_map(children).chain(roots.iter().copied()) {
+        uses[id] += 1;
+    }
+
+    let mut out = Simplified {
+        nodes: Vec::with_capacity(nodes.len()),
+        origin: Vec::new(),
+        consts: HashMap::new(),
+        uses,
+        pinned: HashSet::new(),
+    };
+    let mut map = Vec::with_capacity(nodes.len());
+    for (id, node) in nodes.iter().enumerate() {
+        let new = match node {
+            Node::Input { .. } => out.push(node.clone(), id),
+            Node::Const { .. } if pinned.contains(&id) => {
+                let new = out.push(node.clone(), id);
+                out.pinned.insert(new);
+                new
+            }
+            Node::Const { value } => out.constant(*value),
+            Node::Add { children } => out.associative(true, children.iter().map(|&c| map[c]).collect(), id),
+            Node::Mul { children } => out.associative(false, children.iter().map(|&c| map[c]).collect(), id),
+            Node::Div { left, right } => {
+                let (left, right) = (map[*left], map[*right]);
+                match (out.value(left), out.value(right)) {
+                    (_, Some(r)) if r == 0.0 => out.constant(f64::NAN),
+                    (Some(l), Some(r)) => out.constant(l / r),
+                    (_, Some(r)) if exact_reciprocal(r) => {
+                        let reciprocal = out.constant(1.0 / r);
+                        out.associative(false, vec![left, reciprocal], id)
+                    }
+                    _ => out.push(Node::Div { left, right }, id),
+                }
+            }
+        };
+        map.push(new);
+    }
+    (out.nodes, map)
+}
+
+/// Whether `1 / r` is exactly representable, so that multiplying by it gives
+/// the same result as dividing by `r` for every operand: true for normal
+/// powers of two (whose reciprocals are at worst exact subnormals).
+fn exact_reciprocal(r: f64) -> bool {
+    r.is_normal() && r.to_bits() & ((1 << 52) - 1) == 0
+}
+
+/// `origin` of nodes made up by the pass rather than built for an old node
+const SYNTHETIC: NodeId = usize::MAX;
+
+/// The arena `simplify` is building.
+struct Simplified {
+    nodes: Vec<Node>,
+    /// Old node each new node was built for, so splicing can check its uses
+    origin: Vec<NodeId>,
+    /// Constant node by value bits
+    consts: HashMap<u64, NodeId>,
+    /// Uses of each old node, counting roots
+    uses: Vec<usize>,
+    /// New nodes standing for pinned constants
+    pinned: HashSet<NodeId>,
+}
+
+impl Simplified {
+    fn push(&mut self, node: Node, origin: NodeId) -> NodeId {
+        self.nodes.push(node);
+        self.origin.push(origin);
+        self.nodes.len() - 1
+    }
+
+    fn constant(&mut self, value: f64) -> NodeId {
+        if let Some(&id) = self.consts.get(&value.to_bits()) {
+            return id;
+        }
+        let id = self.push(Node::Const { value }, SYNTHETIC);
+        self.consts.insert(value.to_bits(), id);
+        id
+    }
+
+    /// Value of a constant that may be folded; pinned constants have none.
+    fn value(&self, id: NodeId) -> Option<f64> {
+        match self.nodes[id] {
+            Node::Const { value } if !self.pinned.contains(&id) => Some(value),
+            _ => None,
+        }
+    }
+
+    /// Whether the old node that `term` stands for had no use but its parent.
+    fn private(&self, term: NodeId) -> bool {
+        self.origin[term] != SYNTHETIC && self.uses[self.origin[term]] == 1
+    }
+
+    /// Build a simplified `add` (`is_add`) or `mul` over already simplified
+    /// `terms` on behalf of old node `id`; returns the node standing for it.
+    fn associative(&mut self, is_add: bool, terms: Vec<NodeId>, id: NodeId) -> NodeId {
+        let mut flat = Vec::with_capacity(terms.len());
+        for term in terms {
+            match &self.nodes[term] {
+                Node::Add { children } if is_add && self.private(term) => flat.extend(children),
+                Node::Mul { children } if !is_add && self.private(term) => flat.extend(children),
+                _ => flat.push(term),
+            }
+        }
+        let mut consts = Vec::new();
+        flat.retain(|&term| match self.value(term) {
+            Some(value) => {
+                consts.push(value);
+                false
+            }
+            None => true,
+        });
+
+        let folded: f64 = if is_add { consts.iter().sum() } else { consts.iter().product() };
+        let identity = if is_add { 0.0 } else { 1.0 };
+        if flat.is_empty() {
+            return self.constant(folded);
+        }
+        if !consts.is_empty() && folded != identity {
+            let constant = self.constant(folded);
+            flat.push(constant);
+        }
+        if flat.len() == 1 {
+            // The sole term now stands for `id`; it stays private only if it was
+            let term = flat[0];
+            if self.private(term) {
+                self.origin[term] = id;
+            }
+            return term;
+        }
+        let node = if is_add { Node::Add { children: flat } } else { Node::Mul { children: flat } };
+        self.push(node, id)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn input(name: &str) -> Node {
+        Node::Input { name: name.to_string() }
+    }
+
+    /// Simplify and re-prune, returning each root as an expression.
+    fn simplified(nodes: &[Node], roots: &[NodeId], pinned: &[NodeId]) -> Vec<String> {
+        let (folded, map) = simplify(nodes, roots, pinned);
+        let roots: Vec<NodeId> = roots.iter().map(|&id| map[id]).collect();
+        let (pruned, map) = prune(&folded, &roots).unwrap();
+        roots.iter().map(|&id| expr(&pruned, map[id])).collect()
+    }
+
+    fn expr(nodes: &[Node], id: NodeId) -> String {
+        let list = |children: &[NodeId]| children.iter().map(|&c| expr(nodes, c)).collect::<Vec<_>>().join(", ");
+        match &nodes[id] {
+            Node::Input { name } => name.clone(),
+            Node::Const { value } => format!("{:?}", value),
+            Node::Add { children } => format!("add({})", list(children)),
+            Node::Mul { children } => format!("mul({})", list(children)),
+            Node::Div { left, right } => format!("div({}, {})", expr(nodes, *left), expr(nodes, *right)),
+        }
+    }
+
+    #[test]
+    fn folds_constants_and_splices_private_chains() {
+        let nodes = vec![
+            input("a"),
+            input("b"),
+            input("c"),
+            Node::Const { value: 2.0 },
+            Node::Const { value: 3.0 },
+            Node::Add { children: vec![1, 2, 3] },  // 5: private to 6
+            Node::Add { children: vec![0, 5, 4] },  // 6
+            Node::Mul { children: vec![3, 4] },     // 7: constant-only
+        ];
+        assert_eq!(simplified(&nodes, &[6, 7], &[]), vec!["add(a, b, c, 5.0)", "6.0"]);
+    }
+
+    #[test]
+    fn keeps_shared_children_intact() {
+        let nodes = vec![
+            input("a"),
+            input("b"),
+            input("c"),
+            Node::Add { children: vec![1, 2] },     // 3: used by 4 and a root
+            Node::Add { children: vec![0, 3] },     // 4
+        ];
+        assert_eq!(simplified(&nodes, &[4, 3], &[]), vec!["add(a, add(b, c))", "add(b, c)"]);
+    }
+
+    #[test]
+    fn passthrough_hands_its_uses_to_the_child() {
+        let nodes = vec![
+            input("a"),
+            input("b"),
+            input("c"),
+            Node::Const { value: 1.0 },
+            Node::Add { children: vec![1, 2] },     // 4: private to 5
+            Node::Mul { children: vec![4, 3] },     // 5: * 1, so stands for 4
+            Node::Add { children: vec![0, 5] },     // 6
+        ];
+        // 5 only feeds 6, so the sum it passes through is spliced into 6
+        assert_eq!(simplified(&nodes, &[6], &[]), vec!["add(a, b, c)"]);
+        // 5 is also a root: the sum now has two uses and must stay whole
+        assert_eq!(simplified(&nodes, &[6, 5], &[]), vec!["add(a, add(b, c))", "add(b, c)"]);
+    }
+
+    #[test]
+    fn divides_exactly() {
+        let nodes = vec![
+            input("x"),
+            Node::Const { value: 0.0 },
+            Node::Const { value: 4.0 },
+            Node::Const { value: 10.0 },
+            Node::Const { value: 5e-324 },
+            Node::Div { left: 0, right: 1 },        // 5: by zero
+            Node::Div { left: 0, right: 2 },        // 6: by a power of two
+            Node::Div { left: 0, right: 3 },        // 7: inexact reciprocal
+            Node::Div { left: 0, right: 4 },        // 8: reciprocal overflows
+            Node::Div { left: 3, right: 2 },        // 9: constant-only
+        ];
+        assert_eq!(
+            simplified(&nodes, &[5, 6, 7, 8, 9], &[]),
+            vec!["NaN", "mul(x, 0.25)", "div(x, 10.0)", "div(x, 5e-324)", "2.5"]
+        );
+    }
+
+    #[test]
+    fn leaves_pinned_constants_alone() {
+        let nodes = vec![
+            input("x"),
+            Node::Const { value: 2.0 },             // 1: parameter
+            Node::Const { value: 2.0 },             // 2: plain constant
+            Node::Const { value: 3.0 },
+            Node::Mul { children: vec![0, 1, 2, 3] },
+            Node::Div { left: 0, right: 1 },
+            Node::Div { left: 3, right: 1 },
+        ];
+        let (folded, map) = simplify(&nodes, &[4, 5, 6, 1], &[1]);
+        assert_ne!(map[1], map[2]);
+        assert_eq!(expr(&folded, map[4]), "mul(x, 2.0, 6.0)");
+        assert!(matches!(&folded[map[4]], Node::Mul { children } if children[1] == map[1]));
+        assert_eq!(expr(&folded, map[5]), "div(x, 2.0)");
+        assert_eq!(expr(&folded, map[6]), "div(3.0, 2.0)");
+    }
+}
@@ -0,0 +1,245 @@
+//! Compiled execution plan: a frozen arena flattened into an instruction tape.
+//!
+//! Every node becomes one instruction. Opcodes and operands live in parallel
+//! contiguous arrays, and the children of all `add`/`mul` nodes share a single
+//! CSR-style index buffer, so evaluating a row touches no per-node heap data.
+
+use crate::{Node, NodeId};
+use memmap2::Mmap;
+use std::collections::HashMap;
+use std::ops::Deref;
+use std::sync::Arc;
+
+/// Instruction opcode, one per `Node` variant.
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+#[repr(u8)]
+pub enum Op {
+    Input,
+    Const,
+    Add,
+    Mul,
+    Div,
+}
+
+/// Operand encoding per opcode:
+///
+/// | op    | `a`                  | `b`                       |
+/// |-------|----------------------|---------------------------|
+/// | input | column slot          | unused                    |
+/// | const | index into `consts`  | unused                    |
+/// | add   | start in `children`  | end in `children`         |
+/// | mul   | start in `children`  | end in `children`         |
+/// | div   | left node            | right node                |
+#[derive(Debug, Clone)]
+pub struct Plan {
+    pub ops: Buf<Op>,
+    pub a: Buf<u32>,
+    pub b: Buf<u32>,
+    pub children: Buf<u32>,
+    pub consts: Buf<f64>,
+    /// Input schema: column slot -> input name
+    pub inputs: Vec<String>,
+}
+
+/// Read-only array backing a plan: either owned, or a section of a
+/// memory-mapped binary graph file (see `binary`). Derefs to a slice without
+/// branching on where the data lives.
+pub struct Buf<T> {
+    ptr: *const T,
+    len: usize,
+    owner: Owner<T>,
+}
+
+enum Owner<T> {
+    Vec(Vec<T>),
+    Map(Arc<Mmap>),
+}
+
+// SAFETY: a Buf is immutable and owns (or shares ownership of) its memory.
+// Sending one may move an owned Vec<T> to another thread, so T must be Send
+// as well as Sync.
+unsafe impl<T: Send + Sync> Send for Buf<T> {}
+unsafe impl<T: Send + Sync> Sync for Buf<T> {}
+
+impl<T> Buf<T> {
+    /// View `len` values of type T at byte `offset` in `map`.
+    ///
+    /// # Safety
+    /// The range must lie inside `map`, be aligned for T, and hold valid T
+    /// values.
+    pub unsafe fn mapped(map: &Arc<Mmap>, offset: usize, len: usize) -> Self {
+        Self {
+            ptr: unsafe { map.as_ptr().add(offset) } as *const T,
+            len,
+            owner: Owner::Map(Arc::clone(map)),
+        }
+    }
+}
+
+impl<T> From<Vec<T>> for Buf<T> {
+    fn from(vec: Vec<T>) -> Self {
+        Self { ptr: vec.as_ptr(), len: vec.len(), owner: Owner::Vec(vec) }
+    }
+}
+
+impl<T> Deref for Buf<T> {
+    type Target = [T];
+
+    #[inline]
+    fn deref(&self) -> &[T] {
+        // SAFETY: ptr/len describe memory kept alive and unmodified by `owner`
+        unsafe { std::slice::from_raw_parts(self.ptr, self.len) }
+    }
+}
+
+impl<T: Clone> Clone for Buf<T> {
+    fn clone(&self) -> Self {
+        match &self.owner {
+            Owner::Vec(vec) => Buf::from(vec.clone()),
+            Owner::Map(map) => Self { ptr: self.ptr, len: self.len, owner: Owner::Map(Arc::clone(map)) },
+        }
+    }
+}
+
+impl<T: std::fmt::Debug> std::fmt::Debug for Buf<T> {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        self.deref().fmt(f)
+    }
+}
+
+impl Plan {
+    /// Compile an arena. `inputs` fixes the column order; by default it is the
+    /// order in which Input nodes first appear.
+    pub fn compile(nodes: &[Node], inputs: Option<Vec<String>>) -> Result<Self, String> {
+        if nodes.len() > u32::MAX as usize {
+            return Err(format!("Graph has {} nodes, more than a plan can index", nodes.len()));
+        }
+        let n_children: usize = nodes.iter()
+            .map(|node| match node {
+                Node::Add { children } | Node::Mul { children } => children.len(),
+                _ => 0,
+            })
+            .sum();
+        if n_children > u32::MAX as usize {
+            return Err(format!("Graph has {} child references, more than a plan can index", n_children));
+        }
+
+        let mut inputs = inputs.unwrap_or_default();
+        let explicit = !inputs.is_empty();
+        let mut slot_of: HashMap<String, usize> = inputs.iter()
+            .enumerate()
+            .map(|(slot, name)| (name.clone(), slot))
+            .collect();
+
+        let mut ops = Vec::with_capacity(nodes.len());
+        let mut operands_a = Vec::with_capacity(nodes.len());
+        let mut operands_b = Vec::with_capacity(nodes.len());
+        let mut all_children: Vec<u32> = Vec::with_capacity(n_children);
+        let mut consts = Vec::new();
+
+        for node in nodes {
+            let (op, a, b) = match node {
+                Node::Input { name } => {
+                    let slot = match slot_of.get(name) {
+                        Some(&slot) => slot,
+                        None if explicit => return Err(format!("Input {} is missing from the inputs schema", name)),
+                        None => {
+                            slot_of.insert(name.clone(), inputs.len());
+                            inputs.push(name.clone());
+                            inputs.len() - 1
+                        }
+                    };
+                    (Op::Input, slot as u32, 0)
+                }
+                Node::Const { value } => {
+                    consts.push(*value);
+                    (Op::Const, (consts.len() - 1) as u32, 0)
+                }
+                Node::Add { children } | Node::Mul { children } => {
+                    let start = all_children.len() as u32;
+                    all_children.extend(children.iter().map(|&c| c as u32));
+                    let op = if matches!(node, Node::Add { .. }) { Op::Add } else { Op::Mul };
+                    (op, start, all_children.len() as u32)
+                }
+                Node::Div { left, right } => (Op::Div, *left as u32, *right as u32),
+            };
+            ops.push(op);
+            operands_a.push(a);
+            operands_b.push(b);
+        }
+
+        Ok(Plan {
+            ops: ops.into(),
+            a: operands_a.into(),
+            b: operands_b.into(),
+            children: all_children.into(),
+            consts: consts.into(),
+            inputs,
+        })
+    }
+
+    /// Rebuild the arena this plan was compiled from.
+    pub fn to_nodes(&self) -> Vec<Node> {
+        (0..self.len())
+            .map(|i| {
+                let (a, b) = (self.a[i] as usize, self.b[i] as usize);
+                match self.ops[i] {
+                    Op::Input => Node::Input { name: self.inputs[a].clone() },
+                    Op::Const => Node::Const { value: self.consts[a] },
+                    Op::Add => Node::Add { children: self.children_of(i).iter().map(|&c| c as NodeId).collect() },
+                    Op::Mul => Node::Mul { children: self.children_of(i).iter().map(|&c| c as NodeId).collect() },
+                    Op::Div => Node::Div { left: a, right: b },
+                }
+            })
+            .collect()
+    }
+
+    pub fn len(&self) -> usize {
+        self.ops.len()
+    }
+
+    /// Check that every operand is in range and refers only to earlier
+    /// instructions, as the engines assume.
+    pub fn validate(&self) -> Result<(), String> {
+        let n = self.len();
+        if [self.a.len(), self.b.len()] != [n, n] {
+            return Err("Plan operand arrays do not match the instruction count".to_string());
+        }
+        for i in 0..n {
+            let (a, b) = (self.a[i] as usize, self.b[i] as usize);
+            let ok = match self.ops[i] {
+                Op::Input => a < self.inputs.len(),
+                Op::Const => a < self.consts.len(),
+                Op::Add | Op::Mul => a <= b && b <= self.children.len() && self.children[a..b].iter().all(|&c| (c as usize) < i),
+                Op::Div => a < i && b < i,
+            };
+            if !ok {
+                return Err(format!("Instruction {} has invalid operands", i));
+            }
+        }
+        Ok(())
+    }
+
+    /// Children of an `add`/`mul` instruction.
+    #[inline]
+    pub fn children_of(&self, i: NodeId) -> &[u32] {
+        &self.children[self.a[i] as usize..self.b[i] as usize]
+    }
+
+    /// Evaluate instruction `i` given the values of earlier instructions.
+    #[inline]
+    pub fn eval(&self, i: NodeId, values: &[f64], columns: &[&[f64]], row: usize) -> f64 {
+        let (a, b) = (self.a[i] as usize, self.b[i] as usize);
+        match self.ops[i] {
+            Op::Input => columns[a][row],
+            Op::Const => self.consts[a],
+            Op::Add => self.children[a..b].iter().map(|&c| values[c as usize]).sum(),
+            Op::Mul => self.children[a..b].iter().map(|&c| values[c as usize]).product(),
+            Op::Div => {
+                let l = values[a];
+                let r = values[b];
+                if r == 0.0 { f64::NAN } else { l / r }
+            }
+        }
+    }
+}
@@ -0,0 +1,194 @@
+//! Shape and cost statistics of a frozen arena, for capacity planning and
+//! choosing an engine.
+
+use crate::optimize::children;
+use crate::{Node, NodeId};
+use std::collections::{BTreeMap, HashMap};
+
+/// Estimated cost of evaluating one node for one row, in units of roughly
+/// one floating point add. `add`/`mul` cost one unit per operand after the
+/// first; `div` includes its zero check.
+pub const INPUT_COST: f64 = 1.0;
+pub const CONST_COST: f64 = 0.0;
+pub const OPERAND_COST: f64 = 1.0;
+pub const DIV_COST: f64 = 4.0;
+
+pub struct Stats {
+    pub nodes: usize,
+    /// Node count per type name
+    pub by_type: BTreeMap<&'static str, usize>,
+    /// Longest path from a leaf (inputs and constants are level 0)
+    pub depth: usize,
+    /// Node count per level
+    pub level_widths: Vec<usize>,
+    /// Operand count -> number of `add`/`mul`/`div` nodes with that many
+    pub fan_in: BTreeMap<usize, usize>,
+    /// Use count -> number of nodes used that many times
+    pub fan_out: BTreeMap<usize, usize>,
+    /// Nodes that depend on each input, by input name in first-appearance
+    /// order, counting the input itself
+    pub input_cones: Vec<(String, usize)>,
+    /// Nodes each output depends on, counting the output itself
+    pub output_cones: Vec<(String, usize)>,
+    /// Estimated cost of evaluating every node once
+    pub cost_per_row: f64,
+}
+
+/// Compute statistics for an arena in dependency order (children before
+/// parents) and the named nodes whose cones to measure.
+pub fn compute(nodes: &[Node], outputs: &[(String, NodeId)]) -> Stats {
+    let mut by_type = BTreeMap::new();
+    let mut levels = vec![0usize; nodes.len()];
+    let mut uses = vec![0usize; nodes.len()];
+    let mut fan_in = BTreeMap::new();
+    let mut cost_per_row = 0.0;
+
+    for (id, node) in nodes.iter().enumerate() {
+        *by_type.entry(node.type_name()).or_insert(0) += 1;
+        let mut operands = 0usize;
+        for child in children(node) {
+            levels[id] = levels[id].max(levels[child] + 1);
+            uses[child] += 1;
+            operands += 1;
+        }
+        if !matches!(node, Node::Input { .. } | Node::Const { .. }) {
+            *fan_in.entry(operands).or_insert(0) += 1;
+        }
+        cost_per_row += match node {
+            Node::Input { .. } => INPUT_COST,
+            Node::Const { .. } => CONST_COST,
+            Node::Add { .. } | Node::Mul { .. } => OPERAND_COST * operands.saturating_sub(1) as f64,
+            Node::Div { .. } => DIV_COST,
+        };
+    }
+
+    let depth = levels.iter().copied().max().unwrap_or(0);
+    let mut level_widths = vec![0; if nodes.is_empty() { 0 } else { depth + 1 }];
+    for &level in &levels {
+        level_widths[level] += 1;
+    }
+    let mut fan_out = BTreeMap::new();
+    for &count in &uses {
+        *fan_out.entry(count).or_insert(0) += 1;
+    }
+
+    Stats {
+        nodes: nodes.len(),
+        by_type,
+        depth,
+        level_widths,
+        fan_in,
+        fan_out,
+        input_cones: input_cones(nodes),
+        output_cones: output_cones(nodes, outputs),
+        cost_per_row,
+    }
+}
+
+/// Forward cone size of every input name, propagating per-node bitsets of
+/// the inputs each node depends on.
+fn input_cones(nodes: &[Node]) -> Vec<(String, usize)> {
+    let mut names: Vec<String> = Vec::new();
+    let mut slot_of: HashMap<&str, usize> = HashMap::new();
+    for node in nodes {
+        if let Node::Input { name } = node {
+            slot_of.entry(name).or_insert_with(|| {
+                names.push(name.clone());
+                names.len() - 1
+            });
+        }
+    }
+
+    let words = (names.len() + 63) / 64;
+    let mut depends = vec![0u64; nodes.len() * words];
+    let mut sizes = vec![0usize; names.len()];
+    for (id, node) in nodes.iter().enumerate() {
+        let (done, rest) = depends.split_at_mut(id * words);
+        let row = &mut rest[..words];
+        if let Node::Input { name } = node {
+            let slot = slot_of[name.as_str()];
+            row[slot / 64] |= 1 << (slot % 64);
+        }
+        for child in children(node) {
+            for (word, &bits) in row.iter_mut().zip(&done[child * words..(child + 1) * words]) {
+                *word |= bits;
+            }
+        }
+        for (slot, size) in sizes.iter_mut().enumerate() {
+            *size += (row[slot / 64] >> (slot % 64) & 1) as usize;
+        }
+    }
+    names.into_iter().zip(sizes).collect()
+}
+
+/// Number of nodes each output depends on, counting itself. One stamp per
+/// node, set to the output being walked, marks what has been seen, so the
+/// walks share one allocation.
+fn output_cones(nodes: &[Node], outputs: &[(String, NodeId)]) -> Vec<(String, usize)> {
+    let mut seen = vec![usize::MAX; nodes.len()];
+    let mut stack = Vec::new();
+    outputs.iter()
+        .enumerate()
+        .map(|(walk, (name, root))| {
+            stack.push(*root);
+            seen[*root] = walk;
+            let mut size = 0;
+            while let Some(id) = stack.pop() {
+                size += 1;
+                for child in children(&nodes[id]) {
+                    if seen[child] != walk {
+                        seen[child] = walk;
+                        stack.push(child);
+                    }
+                }
+            }
+            (name.clone(), size)
+        })
+        .collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn input(name: &str) -> Node {
+        Node::Input { name: name.to_string() }
+    }
+
+    #[test]
+    fn small_arena() {
+        // sum = a + b; result = (sum * 2) + (2 / a) + a
+        let nodes = vec![
+            input("a"),
+            input("b"),
+            Node::Const { value: 2.0 },
+            Node::Add { children: vec![0, 1] },
+            Node::Mul { children: vec![3, 2] },
+            Node::Div { left: 2, right: 0 },
+            Node::Add { children: vec![4, 5, 0] },
+        ];
+        let outputs = vec![("sum".to_string(), 3), ("result".to_string(), 6)];
+        let stats = compute(&nodes, &outputs);
+
+        assert_eq!(stats.nodes, 7);
+        let by_type: Vec<(&str, usize)> = stats.by_type.into_iter().collect();
+        assert_eq!(by_type, [("add", 2), ("const", 1), ("div", 1), ("input", 2), ("mul", 1)]);
+        assert_eq!(stats.depth, 3);
+        assert_eq!(stats.level_widths, [3, 2, 1, 1]);
+        let fan_in: Vec<(usize, usize)> = stats.fan_in.into_iter().collect();
+        assert_eq!(fan_in, [(2, 3), (3, 1)]);
+        let fan_out: Vec<(usize, usize)> = stats.fan_out.into_iter().collect();
+        assert_eq!(fan_out, [(0, 1), (1, 4), (2, 1), (3, 1)]);
+        assert_eq!(stats.input_cones, [("a".to_string(), 5), ("b".to_string(), 4)]);
+        assert_eq!(stats.output_cones, [("sum".to_string(), 3), ("result".to_string(), 7)]);
+        assert_eq!(stats.cost_per_row, 2.0 * INPUT_COST + CONST_COST + 4.0 * OPERAND_COST + DIV_COST);
+    }
+
+    #[test]
+    fn empty_arena() {
+        let stats = compute(&[], &[]);
+        assert_eq!((stats.nodes, stats.depth), (0, 0));
+        assert!(stats.level_widths.is_empty());
+        assert_eq!(stats.cost_per_row, 0.0);
+    }
+}